@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Guard the startup of the build-utilities CLI against regressions. Fails
+when the entry point imports a module that must be loaded lazily, spawns a
+process or takes longer to import than the allowed budget.
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+LAZY_MODULES = ["git", "pkg_resources", "importlib.metadata",
+                "tomllib", "concurrent.futures", "asyncio"]
+
+def import_times(src_dir_path):
+  """
+  Return the cumulative import time in microseconds of every module loaded
+  when importing the CLI entry point.
+  """
+  process = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                            "import buildutilities.__main__"],
+                           env=dict(os.environ, PYTHONPATH=src_dir_path),
+                           stderr=subprocess.PIPE, check=True)
+  times = {}
+  for line in process.stderr.decode().splitlines():
+    if not line.startswith("import time:") or "cumulative" in line:
+      continue
+    _, cumulative, name = line[len("import time:"):].split("|")
+    times[name.strip()] = int(cumulative)
+  return times
+
+SPAWN_CHECK = """
+import sys
+spawned = []
+def audit(event, args):
+  if event in ("subprocess.Popen", "os.posix_spawn", "os.exec", "os.fork"):
+    spawned.append(repr(args))
+sys.addaudithook(audit)
+import buildutilities.__main__
+print("\\n".join(spawned))
+"""
+
+def spawned_processes(src_dir_path):
+  """
+  Return the processes spawned when importing the CLI entry point.
+  """
+  output = subprocess.check_output([sys.executable, "-c", SPAWN_CHECK],
+                                   env=dict(os.environ, PYTHONPATH=src_dir_path))
+  return [line for line in output.decode().splitlines() if len(line) != 0]
+
+def main():
+  parser = argparse.ArgumentParser(description="build-utilities startup benchmark")
+  parser.add_argument("--runs", "-r", help="Number of measured imports",
+                      default=10, type=int)
+  parser.add_argument("--budget", "-b", help="Maximum median import time in ms",
+                      default=100, type=float)
+  args = parser.parse_args()
+  src_dir_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+  runs = [import_times(src_dir_path) for _ in range(args.runs)]
+  errors = ["{} is imported at startup".format(module)
+            for module in LAZY_MODULES if module in runs[0]]
+  errors += ["{} is spawned at startup".format(process)
+             for process in spawned_processes(src_dir_path)]
+  median = statistics.median(run["buildutilities.__main__"] for run in runs) / 1000
+  print("Median import time of buildutilities.__main__: {:.1f} ms (budget {:.1f} ms)".format(
+        median, args.budget))
+  if median > args.budget:
+    errors.append("Import time exceeds the budget")
+  if len(errors) != 0:
+    sys.exit("\n".join(errors))
+
+if __name__ == "__main__":
+  main()
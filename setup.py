@@ -55,8 +55,8 @@ def process_setup():
     """
     Setup function
     """
-    if sys.version_info < (3,0):
-        sys.exit("build-utilities only supports python3. Please run setup.py with python3.")
+    if sys.version_info < (3,9):
+        sys.exit("build-utilities requires python 3.9 or later. Please run setup.py with python3.9 or later.")
        
     cmds = versioneer.get_cmdclass()
     cmds["install"] = InstallCommand
@@ -66,6 +66,7 @@ def process_setup():
         cmdclass=cmds,
         packages=find_packages("src"),
         package_dir ={'':'src'},
+        python_requires='>=3.9',
         install_requires=['GitPython>=2.0', 'progressbar2>=2.0.0'],
         author="Alexandre ACEBEDO",
         author_email="Alexandre ACEBEDO",
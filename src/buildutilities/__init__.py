@@ -19,9 +19,65 @@
 """
 This module contains the build-utilities application
 """
+import os
 import sys
-if sys.version_info < (3,0):
-  sys.exit("build-utilities only supports python3. Please check your installation.")
-from ._version import get_versions
-__version__ = get_versions()['version']
-del get_versions
+import json
+if sys.version_info < (3,9):
+  sys.exit("build-utilities requires python 3.9 or later. Please check your installation.")
+
+def _git_state():
+  """
+  Return the git directory of the source checkout holding the package and
+  the modification times of the files describing its HEAD, or None when
+  the package is not run from a checkout.
+  """
+  git_dir_path = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+                              os.path.abspath(__file__)))), ".git")
+  if not os.path.isdir(git_dir_path):
+    return None, None
+  paths = ["HEAD", "index", "packed-refs", os.path.join("refs", "tags")]
+  with open(os.path.join(git_dir_path, "HEAD")) as head_file:
+    head = head_file.read().strip()
+  if head.startswith("ref: "):
+    paths.append(head[len("ref: "):])
+  state = {}
+  for path in paths:
+    try:
+      state[path] = os.stat(os.path.join(git_dir_path, path)).st_mtime_ns
+    except OSError:
+      state[path] = None
+  return git_dir_path, state
+
+def _get_version():
+  """
+  Compute the version with versioneer. In a source checkout versioneer
+  runs several git commands, so the result is memoized in the git directory
+  until HEAD, the index or the refs change.
+  """
+  from ._version import get_versions
+  git_dir_path, state = _git_state()
+  if git_dir_path == None:
+    return get_versions()['version']
+  cache_path = os.path.join(git_dir_path, "build-utilities-version.json")
+  try:
+    with open(cache_path) as cache_file:
+      cache = json.load(cache_file)
+    if cache["state"] == state:
+      return cache["version"]
+  except (OSError, ValueError, KeyError):
+    pass
+  version = get_versions()['version']
+  try:
+    with open(cache_path, "w") as cache_file:
+      json.dump({"state": state, "version": version}, cache_file)
+  except OSError:
+    pass
+  return version
+
+def __getattr__(name):
+  # The version is only computed when it is requested.
+  if name == "__version__":
+    global __version__
+    __version__ = _get_version()
+    return __version__
+  raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
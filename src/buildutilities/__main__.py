@@ -19,26 +19,74 @@ import argparse
 import subprocess
 import sys
 import os
-import uuid
 import time
-import shutil
-from git import Repo
+import functools
+import contextlib
+import contextvars
 from platform import python_version
-import pkg_resources
+from .mirror import MirrorCache, project_url, fetch_revision, resolve_commit
+from .artifacts import ArtifactCache
+from .gocache import GoCache
+from .wheelhouse import Wheelhouse
+from .staging import Stager
+from .workspace import workspace_manager, close_workspace_managers
+from . import descriptor as descriptors
+from .descriptor import write_json
+from .packages import expand_packages, resolve_path, DEFAULT_PACKAGE_PATTERN
+from .checksums import digest_files, ChecksumIndex
+from .scheduler import History, longest_first, makespan
+from .resources import resources
+from .runner import run_command, log
+from .timings import timings, Timings, current as current_timings
+
+DEFAULT_WORKSPACE_ROOT = os.environ.get("BUILD_UTILITIES_WORKSPACE_ROOT",
+                                        os.path.join(os.path.abspath(os.sep), "tmp",
+                                                     "build-utilities"))
+DEFAULT_HISTORY_PATH = os.environ.get("BUILD_UTILITIES_HISTORY",
+                                      os.path.join(os.path.expanduser("~"), ".cache",
+                                                   "build-utilities", "history.sqlite"))
   
+class VersionAction(argparse.Action):
+  """
+  Display the version, which is only looked up when requested.
+  """
+
+  def __init__(self, option_strings, dest=argparse.SUPPRESS,
+               default=argparse.SUPPRESS, help=None):
+    super().__init__(option_strings=option_strings, dest=dest,
+                     default=default, nargs=0, help=help)
+
+  def __call__(self, parser, namespace, values, option_string=None):
+    parser.exit(message="{}\n".format(BuildUtilities.version()))
+
 class BuildUtilities:
   
+  @staticmethod
+  def version():
+    import importlib.metadata
+    try:
+      return importlib.metadata.version("build-utilities")
+    except importlib.metadata.PackageNotFoundError:
+      from . import __version__
+      return __version__
+
   @staticmethod
   def parse_arguments(raw_args):
     parser = argparse.ArgumentParser(prog="build-utilities",
                                  description='Project Builder utilities')
-    parser.add_argument("--version","-v",help="Display version", action='version', version="{}".format(pkg_resources.require("build-utilities")[0].version))
+    parser.add_argument("--version","-v",help="Display version", action=VersionAction)
+    parser.add_argument("--timings-out", help="Write the timings of the build phases to a JSON file",
+                        default=None, type=str)
+    parser.add_argument("--trace", help="Write the build phases and processes as a Chrome trace file",
+                        default=None, type=str)
+    parser.add_argument("--daemon", help="Run the command on the build server listening on this socket",
+                        default=os.environ.get("BUILD_UTILITIES_DAEMON"), type=str)
     rootSubparsers = parser.add_subparsers(dest="function")
     buildParser = rootSubparsers.add_parser('build', help='Build packages')
     buildParser.add_argument('--project', '-p', required=True,
                              help="Github project", type=str)
-    buildParser.add_argument('--arch', '-a', required=True,
-                             help='Architecture to build', type=str)
+    buildParser.add_argument('--arch', '-a', required=True, nargs='+', action='extend',
+                             help='Architectures to build', type=str)
     buildParser.add_argument('--branch_or_revision', '-b', help='Git branch or revision to build',
                              default="master", type=str)
     buildParser.add_argument('--binname', '-bn', required=True,
@@ -47,6 +95,63 @@ class BuildUtilities:
                         required=True, type=str)
     buildParser.add_argument('--language', '-l', help='language',
                         required=True, type=str, choices=["go","python"])
+    buildParser.add_argument('--mirrorcache', '-mc',
+                             help='Directory holding bare mirrors of the cloned projects',
+                             default=os.environ.get("BUILD_UTILITIES_MIRROR_CACHE"), type=str)
+    buildParser.add_argument('--fetchmode', '-fm',
+                             help='Clone the whole history or only fetch the revision to build',
+                             default="full", type=str, choices=["full","shallow"])
+    buildParser.add_argument('--artifactcache', '-ac',
+                             help='Directory caching build outputs by commit and build parameters',
+                             default=os.environ.get("BUILD_UTILITIES_ARTIFACT_CACHE"), type=str)
+    buildParser.add_argument('--artifactcachesize', '-acs',
+                             help='Maximum size of the artifact cache in MB',
+                             default=10240, type=int)
+    buildParser.add_argument('--gocache', '-gc',
+                             help='Directory holding the go build and module caches',
+                             default=os.environ.get("BUILD_UTILITIES_GO_CACHE"), type=str)
+    buildParser.add_argument('--gocachesize', '-gcs',
+                             help='Maximum size of the go caches in MB',
+                             default=20480, type=int)
+    buildParser.add_argument('--target', '-t', action='append',
+                             help='Go package to build instead of the main package producing binname',
+                             default=None, type=str)
+    buildParser.add_argument('--pythonbuilder', '-pb',
+                             help='Install python projects with setup.py or from wheels',
+                             default="setup", type=str, choices=["setup","wheel"])
+    buildParser.add_argument('--wheelhouse', '-wh',
+                             help='Directory caching the wheels of python dependencies',
+                             default=os.environ.get("BUILD_UTILITIES_WHEELHOUSE",
+                                                    os.path.join(os.path.expanduser("~"), ".cache",
+                                                                 "build-utilities", "wheelhouse")),
+                             type=str)
+    buildParser.add_argument('--timeout', '-to',
+                             help='Maximum duration in seconds of each toolchain command',
+                             default=None, type=float)
+    buildParser.add_argument('--jobs', '-j',
+                             help='Maximum number of architectures built concurrently',
+                             default=os.cpu_count(), type=int)
+    buildParser.add_argument('--staging', '-st',
+                             help='Copy go binaries and resources, reflink them, or hardlink them to the build tree',
+                             default="clone", type=str, choices=Stager.MODES)
+    buildParser.add_argument('--workspaceroot', '-wr',
+                             help='Directory holding the scratch workspaces of the builds, e.g. on a tmpfs',
+                             default=DEFAULT_WORKSPACE_ROOT, type=str)
+    buildParser.add_argument('--workspacepool', '-wp',
+                             help='Number of empty workspaces kept ready for reuse',
+                             default=4, type=int)
+    buildParser.add_argument('--cpus', '-cpu',
+                             help='Number of CPUs shared by the toolchain commands, ignored by the jobs of a build server or a thread batch',
+                             default=None, type=int)
+    buildParser.add_argument('--memory', '-mem',
+                             help='Memory in MB shared by the toolchain commands, 80%% of the physical memory by default, ignored by the jobs of a build server or a thread batch',
+                             default=None, type=int)
+    buildParser.add_argument('--history', '-hi',
+                             help='SQLite store of the peak memory usage of the toolchain commands',
+                             default=DEFAULT_HISTORY_PATH, type=str)
+    buildParser.add_argument('--incremental', '-in',
+                             help='Update a non empty output directory, only rewriting the files which changed',
+                             action='store_true')
         
     deployDescParser = rootSubparsers.add_parser('deploydesc',
                                                  help='Create bintray deployement \
@@ -67,89 +172,230 @@ class BuildUtilities:
                                   help='Output path',
                                   required=True, type=str)
     deployDescParser.add_argument('--package','-pa',nargs=3, 
-                                  help='Package to upload with distribution and architecture', 
+                                  help='Package, directory or glob of packages to upload with distribution and architecture', 
                                   metavar=("<package path>","<distribution>","architecture"), 
-                                  action='append', type=str, required=True)
+                                  action='append', type=str, default=[])
+    deployDescParser.add_argument('--packages', '-ps',
+                                  help='Directory or glob of packages whose distribution and architecture are parsed from their names',
+                                  action='append', type=str, default=[])
+    deployDescParser.add_argument('--packagepattern', '-pp',
+                                  help='Regular expression parsing the distribution and architecture groups of package names',
+                                  default=DEFAULT_PACKAGE_PATTERN, type=str)
+    deployDescParser.add_argument('--distribution', '-di',
+                                  help='Distribution of the packages whose names do not hold one',
+                                  default=None, type=str)
     deployDescParser.add_argument('--licenses', '-li', help='Software licences',
                         default=[], type=str, action='append')
     deployDescParser.add_argument('--labels', '-la', help='Package labels',
                                   action='append',
                         default=[], type=str)
+    deployDescParser.add_argument('--compact', '-cp', help='Write the descriptor without indentation',
+                                  action='store_true')
+    deployDescParser.add_argument('--checksums', '-cs',
+                                  help='Add the size and the MD5, SHA1 and SHA256 digests of each file',
+                                  action='store_true')
+    deployDescParser.add_argument('--checksumindex', '-ci',
+                                  help='SQLite index of the digests of the files unchanged since they were hashed',
+                                  default=os.environ.get("BUILD_UTILITIES_CHECKSUM_INDEX",
+                                                         os.path.join(os.path.expanduser("~"), ".cache",
+                                                                      "build-utilities", "checksums.sqlite")),
+                                  type=str)
+    deployDescParser.add_argument('--rehash', '-rh',
+                                  help='Hash all the files again, ignoring the checksum index',
+                                  action='store_true')
+    deployDescParser.add_argument('--update', '-up',
+                                  help='Merge the packages into an existing descriptor instead of failing',
+                                  action='store_true')
+    deployDescParser.add_argument('--removepackage', '-rp',
+                                  help='Path or glob of packages to remove from an updated descriptor',
+                                  action='append', type=str, default=[])
+
+    batchParser = rootSubparsers.add_parser('batch',
+                                            help='Run the build jobs of a manifest, then its deploydesc jobs')
+    batchParser.add_argument('--manifest', '-m', required=True,
+                             help='JSON or TOML manifest listing the jobs', type=str)
+    batchParser.add_argument('--concurrency', '-c',
+                             help='Maximum number of jobs run concurrently',
+                             default=None, type=int)
+    batchParser.add_argument('--pool', '-po',
+                             help='Run each job in its own process or in a thread of the batch process',
+                             default="process", type=str, choices=["process","thread"])
+    batchParser.add_argument('--history', '-hi',
+                             help='SQLite store of the job durations used to start the longest jobs first',
+                             default=DEFAULT_HISTORY_PATH, type=str)
+
+    serveParser = rootSubparsers.add_parser('serve',
+                                            help='Run a resident build server on a unix socket')
+    serveParser.add_argument('--socket', '-s', required=True,
+                             help='Path of the unix socket to listen on', type=str)
+    serveParser.add_argument('--workers', '-w',
+                             help='Maximum number of requests run concurrently',
+                             default=os.cpu_count(), type=int)
     return parser.parse_args(raw_args)
   
   @staticmethod
-  def generate_tmp_dir():
-    tmp_dir_path = None
-    for _ in range(0, 5):
-      tmp_dir_path = os.path.join(os.path.abspath(os.sep), "tmp", str(uuid.uuid4()))
-      if not os.path.exists(tmp_dir_path) :
-        os.makedirs(tmp_dir_path, exist_ok=True)
-        break
-      else:
-        tmp_dir_path = None
-    if tmp_dir_path == None:
-      raise Exception("Unable to generate a tmp direcctory")
-    return tmp_dir_path
+  def check_empty_dir(dir_path):
+    if os.path.exists(dir_path) and len(os.listdir(dir_path)) != 0:
+      raise Exception("Build error: {} is not empty.".format(dir_path))
+
+  @staticmethod
+  def arch_output_dir_path(output_dir_path, arch, arch_subdirs):
+    if arch_subdirs:
+      return os.path.join(output_dir_path, arch)
+    return output_dir_path
   
   @staticmethod
-  def build_python(output_dir_path, project, branch_or_revision, arch, bin_name):
-    if len(os.listdir(output_dir_path)) != 0:
-      raise Exception("Build error: {} is not empty.".format(output_dir_path))
+  def clone_project(project, branch_or_revision, src_dir_path, mirror_cache=None,
+                    fetch_mode="full"):
+    if fetch_mode == "shallow":
+      if mirror_cache != None:
+        return mirror_cache.fetch(project, branch_or_revision, src_dir_path)
+      return fetch_revision(project_url(project), branch_or_revision, src_dir_path)
+    if mirror_cache != None:
+      repo = mirror_cache.clone(project, src_dir_path)
+    else:
+      from git import Repo
+      repo = Repo.clone_from(project_url(project), src_dir_path)
+    repo.git.checkout(branch_or_revision)
+    return repo
+  
+  @staticmethod
+  def build_python(output_dir_path, project, branch_or_revision, arch, bin_name,
+                   mirror_cache=None, fetch_mode="full", wheelhouse=None, timeout=None):
+    BuildUtilities.check_empty_dir(output_dir_path)
     
     src_dir_path = os.path.join(output_dir_path, "src")
     install_dir_path = os.path.join(output_dir_path, "install")
     
-    repo = Repo.clone_from("https://github.com/{}".format(project), src_dir_path)
-    repo.git.checkout(branch_or_revision)
+    with timings.phase("clone", project=project, arch=arch):
+      repo = BuildUtilities.clone_project(project, branch_or_revision, src_dir_path,
+                                          mirror_cache, fetch_mode)
     os.makedirs(os.path.join(install_dir_path,"lib","python{}.{}".format(python_version()[0],python_version()[2]),"site-packages"),exist_ok = True)
-    process = subprocess.Popen(["python3", "./setup.py", "install", "--prefix={}".format(install_dir_path)],
-                     cwd=src_dir_path, shell=False,
-                     env=dict(os.environ,PYTHONPATH=os.path.join(install_dir_path,"lib","python{}.{}".format(python_version()[0],python_version()[2]),"site-packages")))
-    process.communicate()
-    if process.returncode != 0:
-      raise Exception("Error while getting dependencies project")
+    env = dict(os.environ,PYTHONPATH=os.path.join(install_dir_path,"lib","python{}.{}".format(python_version()[0],python_version()[2]),"site-packages"))
+    prefix = "[{} {}] ".format(project, arch)
+    with timings.phase("install", project=project, arch=arch):
+      if wheelhouse != None:
+        wheelhouse.install(src_dir_path, install_dir_path, env, prefix, timeout, project)
+      elif resources.run(["python3", "./setup.py", "install", "--prefix={}".format(install_dir_path)],
+                         src_dir_path, env, prefix, timeout, project, resources.cpus) != 0:
+        raise Exception("Error while getting dependencies project")
+    return repo.head.commit.hexsha
   
   @staticmethod
-  def build_go(output_dir_path, project, branch_or_revision, arch, bin_name):
-    if len(os.listdir(output_dir_path)) != 0:
-      raise Exception("Build error: {} is not empty.".format(output_dir_path))
-    go_dir_path = os.path.join(BuildUtilities.generate_tmp_dir(), "go")
-    print("Go path is : {}".format(go_dir_path))
-    src_dir_path = os.path.join(go_dir_path, 'src', "github.com", project)
+  def go_environment(go_cache, arch):
+    if go_cache != None:
+      return go_cache.environment(arch)
+    return contextlib.nullcontext({})
+
+  @staticmethod
+  def select_go_packages(src_dir_path, env, bin_name, prefix="", timeout=None):
+    output = []
+    if run_command(["go", "list", "-f",
+                    '{{if eq .Name "main"}}{{.ImportPath}} {{.Target}}{{end}}', "./..."],
+                   src_dir_path, env, prefix, timeout, output) != 0:
+      raise Exception("Error while listing the go packages")
+    for line in output:
+      if len(line) == 0:
+        continue
+      import_path, target = line.split(" ", 1)
+      if os.path.basename(target) == bin_name:
+        return [import_path]
+    log("No main package produces {}, building all packages".format(bin_name))
+    return ["./..."]
+
+  @staticmethod
+  def install_go(go_dir_path, src_dir_path, project, arch, output_dir_path, packages,
+                 go_cache=None, timeout=None, stager=None, cpus=1):
+    if stager == None:
+      stager = Stager("copy")
+    with BuildUtilities.go_environment(go_cache, arch) as go_env:
+      env = dict(os.environ,
+                 GOARCH=arch,
+                 GOPATH=go_dir_path,
+                 CGO_ENABLED="0",
+                 **go_env)
+      with timings.phase("install", project=project, arch=arch):
+        if resources.run(["go", "install"] + packages, src_dir_path, env,
+                         "[{} {}] ".format(project, arch), timeout, project, cpus) != 0:
+          raise Exception("Error while build the project for {}".format(arch))
+        # Cross compiled binaries are installed in an arch specific directory.
+        output = []
+        if run_command(["go", "list", "-f", '{{if eq .Name "main"}}{{.Target}}{{end}}']
+                       + packages, src_dir_path, env, "[{} {}] ".format(project, arch),
+                       timeout, output) != 0:
+          raise Exception("Error while listing the go binaries for {}".format(arch))
+        targets = [target for line in output for target in line.split()]
+    with timings.phase("copy", project=project, arch=arch):
+      bin_dir_path = os.path.join(output_dir_path, "packaging",
+                                      "usr", "local", "bin")
+      os.makedirs(bin_dir_path)
+      for target in targets:
+        stager.copy_file(target, os.path.join(bin_dir_path, os.path.basename(target)))
     
-    repo = Repo.clone_from("https://github.com/{}".format(project), src_dir_path)
-    repo.git.checkout(branch_or_revision)
-    process = subprocess.Popen(["go", "get", "-d", "./..."],
-                     cwd=src_dir_path, shell=False,
-                     env=dict(os.environ,
-                              GOARCH=arch,
-                              GOPATH=go_dir_path,
-                              CGO_ENABLED="0"))
-    process.communicate()
-    if process.returncode != 0:
-      raise Exception("Error while getting dependencies project")
-  
-    process = subprocess.Popen(["go", "install", "./..."],
-                     cwd=src_dir_path, shell=False,
-                     env=dict(os.environ,
-                              GOARCH=arch,
-                              GOPATH=go_dir_path,
-                              CGO_ENABLED="0"))
-    process.communicate()
-    if process.returncode != 0:
-      raise Exception("Error while build the project")
-    bin_dir_path = os.path.join(output_dir_path, "packaging",
-                                    "usr", "local", "bin")
-    os.makedirs(bin_dir_path)
-    for dirName, _, fileList in os.walk(os.path.join(go_dir_path, "bin")):
-      for fname in fileList:
-          shutil.copy2(os.path.join(dirName, fname),
-                       os.path.join(bin_dir_path, fname))
-  
-    if os.path.exists(os.path.join(src_dir_path, "resources")) :
-      for name in os.listdir(os.path.join(src_dir_path, "resources")):
-        shutil.copytree(os.path.join(src_dir_path, "resources", name),
-                        os.path.join(output_dir_path, "packaging", name))
+      if os.path.exists(os.path.join(src_dir_path, "resources")) :
+        for name in os.listdir(os.path.join(src_dir_path, "resources")):
+          stager.copy_tree(os.path.join(src_dir_path, "resources", name),
+                           os.path.join(output_dir_path, "packaging", name))
+
+  @staticmethod
+  def build_go(output_dir_path, project, branch_or_revision, arch, bin_name,
+               mirror_cache=None, fetch_mode="full", go_cache=None, jobs=None,
+               arch_subdirs=None, targets=None, timeout=None, staging="clone",
+               workspaces=None):
+    archs = [arch] if isinstance(arch, str) else list(arch)
+    if arch_subdirs == None:
+      arch_subdirs = len(archs) > 1
+    for arch in archs:
+      BuildUtilities.check_empty_dir(BuildUtilities.arch_output_dir_path(output_dir_path,
+                                                                          arch, arch_subdirs))
+    if workspaces == None:
+      workspaces = workspace_manager(DEFAULT_WORKSPACE_ROOT)
+    with workspaces.workspace() as workspace_path:
+      go_dir_path = os.path.join(workspace_path, "go")
+      log("Go path is : {}".format(go_dir_path))
+      src_dir_path = os.path.join(go_dir_path, 'src', "github.com", project)
+    
+      with timings.phase("clone", project=project):
+        repo = BuildUtilities.clone_project(project, branch_or_revision, src_dir_path,
+                                            mirror_cache, fetch_mode)
+      # Dependencies are only downloaded once, later archs only fetch the
+      # packages restricted to them by build constraints.
+      for arch in archs:
+        with BuildUtilities.go_environment(go_cache, arch) as go_env:
+          env = dict(os.environ,
+                     GOARCH=arch,
+                     GOPATH=go_dir_path,
+                     CGO_ENABLED="0",
+                     **go_env)
+          with timings.phase("dependencies", project=project, arch=arch):
+            if resources.run(["go", "get", "-d", "./..."], src_dir_path, env,
+                             "[{} {}] ".format(project, arch), timeout, project) != 0:
+              raise Exception("Error while getting dependencies project")
+          if targets == None:
+            with timings.phase("select", project=project, arch=arch):
+              targets = BuildUtilities.select_go_packages(src_dir_path, env, bin_name,
+                                                          "[{} {}] ".format(project, arch),
+                                                          timeout)
+
+      stager = Stager(staging)
+      # The CPUs are shared between the archs installed at the same time.
+      cpus = max(1, resources.cpus // min(jobs or len(archs), len(archs)))
+      import concurrent.futures
+      with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(contextvars.copy_context().run,
+                                   BuildUtilities.install_go, go_dir_path, src_dir_path,
+                                   project, arch,
+                                   BuildUtilities.arch_output_dir_path(output_dir_path,
+                                                                       arch, arch_subdirs),
+                                   targets, go_cache, timeout, stager, cpus)
+                   for arch in archs]
+        for future in futures:
+          future.result()
+      log(stager.report())
+      if go_cache != None:
+        with timings.phase("prune", project=project):
+          go_cache.prune()
+      return repo.head.commit.hexsha
         
   @staticmethod
   def generate_bintray_descriptor(output_path,
@@ -161,10 +407,28 @@ class BuildUtilities:
                                 version,
                                 packages,
                                 licenses=[],
-                                labels=[]):
-    if os.path.exists(output_path) :
+                                labels=[],
+                                compact=False,
+                                package_sources=[],
+                                package_pattern=DEFAULT_PACKAGE_PATTERN,
+                                distribution=None,
+                                checksums=False,
+                                checksum_index_path=None,
+                                rehash=False,
+                                update=False,
+                                removed_packages=[],
+                                base_dir_path=None):
+    if os.path.exists(output_path) and not update:
       raise Exception("File {} exists".format(output_path))
-    github_addr = "https://github.com/{}".format(project)
+    if len(packages) == 0 and len(package_sources) == 0 and not update:
+      raise Exception("No package given")
+    with timings.phase("packages", project=project):
+      packages, skipped = expand_packages(packages, package_sources, package_pattern,
+                                          distribution, base_dir_path=base_dir_path)
+    for path, reason in skipped:
+      log("Skipped {}: {}".format(path, reason))
+    log("{} packages, {} skipped".format(len(packages), len(skipped)))
+    github_addr = project_url(project)
     descriptor = {"package":{
                              "name":bin_name,
                              "repo":repository,
@@ -186,53 +450,428 @@ class BuildUtilities:
                              "vcs_tag":version,
                              "gpgSign":False
                              },
-                  "files":[],
+                  "files":None,
                   "publish":True
                   }
     
-    for p in packages: 
-      if os.path.isfile(p[0]):
-        descriptor["files"].append({
-                        "includePattern": os.path.join(os.path.dirname(p[0]),"({})".format(os.path.basename(p[0]))),
-                        "uploadPattern": os.path.join(p[1],"$1"),
-                        "matrixParams":
-                          {
-                            "deb_distribution":p[1],
-                            "deb_component":"main",
-                            "deb_architecture":p[2]
-                           }
-                       })
-    outfile = open(output_path, 'w')
-    json.dump(descriptor, outfile, ensure_ascii=False, indent=2)
-    outfile.close()
+    checksum_index = None
+    if checksums and checksum_index_path != None:
+      checksum_index = ChecksumIndex(checksum_index_path)
+    # The files are generated while the descriptor is written.
+    descriptor["files"] = BuildUtilities.descriptor_files(packages, checksums,
+                                                          checksum_index, rehash,
+                                                          base_dir_path)
+    try:
+      with timings.phase("write", project=project):
+        if update:
+          with descriptors.lock(output_path):
+            BuildUtilities.update_descriptor(output_path, descriptor, removed_packages, compact,
+                                             base_dir_path)
+        else:
+          write_json(output_path, descriptor, None if compact else 2)
+    finally:
+      if checksum_index != None:
+        checksum_index.close()
+    if checksum_index != None:
+      log("Checksum index: {} files unchanged, {} hashed".format(
+            checksum_index.hits, len(packages) - checksum_index.hits))
+
+  @staticmethod
+  def update_descriptor(output_path, descriptor, removed_packages=[], compact=False,
+                        base_dir_path=None):
+    """
+    Merge descriptor into the one at output_path, only rewriting it when
+    its content changes.
+    """
+    if not os.path.exists(output_path):
+      write_json(output_path, descriptor, None if compact else 2)
+      return
+    with open(output_path) as infile:
+      previous = json.load(infile)
+    descriptor["files"] = list(descriptor["files"])
+    merged, dropped = descriptors.merge(previous, descriptor, removed_packages, base_dir_path)
+    if descriptors.canonical_hash(merged) == descriptors.canonical_hash(previous):
+      log("Descriptor {} unchanged".format(output_path))
+      return
+    log("Updating descriptor {}: {} files, {} dropped".format(output_path,
+                                                             len(merged["files"]), dropped))
+    merged["files"] = iter(merged["files"])
+    write_json(output_path, merged, None if compact else 2)
+
+  @staticmethod
+  def descriptor_files(packages, checksums=False, checksum_index=None, rehash=False,
+                       base_dir_path=None):
+    digests = [None] * len(packages)
+    if checksums:
+      # The index is shared between working directories, it is keyed on absolute paths.
+      digests = digest_files([(os.path.abspath(resolve_path(p[0], base_dir_path)), p[3])
+                              for p in packages], index=checksum_index, rehash=rehash)
+    for p, digest in zip(packages, digests): 
+      entry = {
+                "includePattern": os.path.join(os.path.dirname(p[0]),"({})".format(os.path.basename(p[0]))),
+                "uploadPattern": os.path.join(p[1],"$1"),
+                "matrixParams":
+                  {
+                    "deb_distribution":p[1],
+                    "deb_component":"main",
+                    "deb_architecture":p[2]
+                   }
+               }
+      if digest != None:
+        entry.update(digest)
+      yield entry
+
+  @staticmethod
+  @functools.lru_cache(maxsize=None)
+  def open_history(history_path):
+    return History(history_path)
+
+  @staticmethod
+  def configure_resources(cpus=None, memory=None, history_path=None):
+    """
+    Set the limits of the resource pool shared by all the jobs of the
+    process, memory being in MB. Only called once, when the process starts,
+    so that a job can not change the budget of the others.
+    """
+    resources.configure(cpus, memory * 1024 * 1024 if memory != None else None,
+                        BuildUtilities.open_history(history_path)
+                        if history_path != None else None)
+
+  @staticmethod
+  @functools.lru_cache(maxsize=None)
+  def toolchain_version(language):
+    command = {"go": ["go", "version"], "python": ["python3", "--version"]}[language]
+    return subprocess.check_output(command, stderr=subprocess.STDOUT).decode().strip()
+
+  @staticmethod
+  def build(args):
+    if not os.path.exists(args.outputdir):
+      os.makedirs(args.outputdir, exist_ok=True)
+    workspaces = workspace_manager(args.workspaceroot, args.workspacepool)
+    # Incremental builds happen in a scratch directory synchronized with the
+    # output directory at the end.
+    build_dir = contextlib.nullcontext(args.outputdir)
+    if args.incremental:
+      build_dir = workspaces.workspace()
+    with build_dir as build_dir_path:
+      archs = list(dict.fromkeys(args.arch))
+      arch_subdirs = len(archs) > 1
+      if args.language == "python":
+        if arch_subdirs:
+          raise Exception("Python projects can only be built for one architecture")
+        build_function = BuildUtilities.build_python
+        artifact_dir_name = "install"
+      elif args.language == "go":
+        build_function = BuildUtilities.build_go
+        artifact_dir_name = "packaging"
+      else:
+        raise Exception("Invalid language {}".format(args.language))
+      mirror_cache = None
+      if args.mirrorcache != None:
+        mirror_cache = MirrorCache(args.mirrorcache)
+      options = {"mirror_cache": mirror_cache, "fetch_mode": args.fetchmode,
+                 "timeout": args.timeout}
+      if args.language == "go":
+        options["jobs"] = args.jobs
+        options["arch_subdirs"] = arch_subdirs
+        options["targets"] = args.target
+        options["staging"] = args.staging
+        options["workspaces"] = workspaces
+        if args.gocache != None:
+          options["go_cache"] = GoCache(args.gocache, args.gocachesize * 1024 * 1024)
+      elif args.pythonbuilder == "wheel":
+        options["wheelhouse"] = Wheelhouse(args.wheelhouse)
+
+      def artifact_dir_path(arch, root_dir_path=build_dir_path):
+        return os.path.join(BuildUtilities.arch_output_dir_path(root_dir_path,
+                                                                arch, arch_subdirs),
+                            artifact_dir_name)
+
+      artifact_cache = None
+      if args.artifactcache != None:
+        artifact_cache = ArtifactCache(args.artifactcache,
+                                       args.artifactcachesize * 1024 * 1024)
+        for arch in archs:
+          BuildUtilities.check_empty_dir(BuildUtilities.arch_output_dir_path(build_dir_path,
+                                                                              arch, arch_subdirs))
+        builder = args.pythonbuilder if args.language == "python" else None
+        with timings.phase("resolve", project=args.project):
+          toolchain_version = BuildUtilities.toolchain_version(args.language)
+          commit = resolve_commit(args.project, args.branch_or_revision, mirror_cache)
+        for arch in list(archs):
+          with timings.phase("restore", project=args.project, arch=arch):
+            restored = commit != None and artifact_cache.restore(
+              ArtifactCache.key(commit, arch, args.language, toolchain_version,
+                                args.binname, args.target, builder),
+              artifact_dir_path(arch))
+          if restored:
+            log("Restored {} for {} from the artifact cache".format(commit, arch))
+            archs.remove(arch)
+
+      if len(archs) != 0:
+        commit = build_function(build_dir_path,
+                                args.project, args.branch_or_revision,
+                                archs if args.language == "go" else archs[0],
+                                args.binname, **options)
+        if artifact_cache != None:
+          # Key on the commit actually built, the branch may have moved meanwhile.
+          for arch in archs:
+            with timings.phase("store", project=args.project, arch=arch):
+              artifact_cache.store(ArtifactCache.key(commit, arch, args.language,
+                                                     toolchain_version, args.binname, args.target,
+                                                     builder),
+                                   artifact_dir_path(arch))
+
+      if artifact_cache != None:
+        statistics = artifact_cache.statistics()
+        log("Artifact cache: {} hits, {} misses, {} entries, {} bytes".format(
+              statistics["hits"], statistics["misses"],
+              statistics["entries"], statistics["size"]))
+
+      if args.incremental:
+        stager = Stager(args.staging)
+        for arch in dict.fromkeys(args.arch):
+          with timings.phase("sync", project=args.project, arch=arch):
+            counts = stager.sync_tree(artifact_dir_path(arch),
+                                      artifact_dir_path(arch, args.outputdir))
+          log("Synchronized {}: {} unchanged, {} updated, {} removed".format(
+                artifact_dir_path(arch, args.outputdir), counts["unchanged"],
+                counts["updated"], counts["removed"]))
+
+  @staticmethod
+  def load_manifest(manifest_path):
+    if manifest_path.endswith(".toml"):
+      try:
+        import tomllib
+      except ImportError:
+        raise Exception("TOML manifests require python 3.11 or later")
+      with open(manifest_path, "rb") as manifest_file:
+        return tomllib.load(manifest_file)
+    with open(manifest_path) as manifest_file:
+      return json.load(manifest_file)
+
+  @staticmethod
+  def job_arguments(job, defaults={}):
+    """
+    Convert a manifest job into the command line of its subcommand, so that
+    it gets the same defaults and validation as a direct invocation.
+    """
+    function = job.get("function", "build")
+    job = dict(defaults.get(function, {}), **job)
+    raw_args = [function]
+    for name, value in job.items():
+      if name == "function":
+        continue
+      option = "--{}".format(name)
+      values = value if isinstance(value, list) else [value]
+      for value in values:
+        if isinstance(value, bool):
+          # Flags take no value.
+          if value:
+            raw_args.append(option)
+        elif isinstance(value, list):
+          raw_args += [option] + [str(item) for item in value]
+        else:
+          raw_args += [option, str(value)]
+    job_args = BuildUtilities.parse_arguments(raw_args)
+    return job_args
+
+  @staticmethod
+  def job_key(job_args):
+    return " ".join([job_args.function, job_args.project, job_args.binname,
+                     ",".join(sorted(getattr(job_args, "arch", [])))])
+
+  @staticmethod
+  def batch(args):
+    manifest = BuildUtilities.load_manifest(args.manifest)
+    concurrency = args.concurrency
+    if concurrency == None:
+      concurrency = manifest.get("concurrency", os.cpu_count())
+    jobs = [BuildUtilities.job_arguments(job, manifest.get("defaults", {}))
+            for job in manifest.get("jobs", [])]
+    for job_args in jobs:
+      BuildUtilities.resolve_paths(job_args, getattr(args, "cwd", os.getcwd()))
+    history = None
+    if args.history != None:
+      history = History(args.history)
+
+    def run_job(index):
+      job_args = jobs[index]
+      start = time.perf_counter()
+      try:
+        with timings.phase("job", project=job_args.project, function=job_args.function):
+          if process_pool != None:
+            process_pool.submit(worker.run_job, job_args, "[job {}] ".format(index)).result()
+          else:
+            BuildUtilities.run(job_args)
+        return ("ok", time.perf_counter() - start, "")
+      except Exception as e:
+        # Only the first line fits in the summary, some exceptions have none.
+        message = (str(e).strip().splitlines() or [type(e).__name__])[0]
+        return ("failed", time.perf_counter() - start, message)
+
+    import concurrent.futures
+    process_pool = None
+    if args.pool == "process":
+      import multiprocessing
+      from . import worker
+      # Workers are reused by the jobs. They are started by a fork server, as
+      # forking the threads dispatching the jobs is unsafe.
+      process_pool = concurrent.futures.ProcessPoolExecutor(
+        max_workers=concurrency, mp_context=multiprocessing.get_context("forkserver"),
+        initializer=worker.initialize,
+        initargs=(max(1, resources.cpus // concurrency),
+                  resources.memory // concurrency // (1024 * 1024), args.history))
+    # Descriptors reference the packages built by the build jobs. Within each
+    # stage the longest jobs are started first so that they do not end last.
+    results = [None] * len(jobs)
+    predictions = [None] * len(jobs)
+    predicted_makespan = 0.0
+    start = time.perf_counter()
+    try:
+      with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for function in ("build", "deploydesc"):
+          indexes = [index for index, job_args in enumerate(jobs) if job_args.function == function]
+          order = range(len(indexes))
+          if history != None:
+            for index in indexes:
+              predictions[index] = history.predict(BuildUtilities.job_key(jobs[index]))
+            order, durations = longest_first([predictions[index] for index in indexes])
+            predicted_makespan += makespan([durations[position] for position in order],
+                                           concurrency)
+          futures = {indexes[position]: executor.submit(contextvars.copy_context().run,
+                                                        run_job, indexes[position])
+                     for position in order}
+          for index, future in futures.items():
+            results[index] = future.result()
+    finally:
+      if process_pool != None:
+        process_pool.shutdown()
+    actual_makespan = time.perf_counter() - start
+
+    log("{:<4} {:<10} {:<30} {:<16} {:<7} {:>9} {:>12}  {}".format(
+          "job", "function", "project", "arch", "status", "time(s)", "predicted(s)", "error"))
+    for index, (job_args, (status, duration, error)) in enumerate(zip(jobs, results)):
+      log("{:<4} {:<10} {:<30} {:<16} {:<7} {:>9.2f} {:>12}  {}".format(
+            index, job_args.function, job_args.project,
+            ",".join(getattr(job_args, "arch", [])), status, duration,
+            "{:.2f}".format(predictions[index]) if predictions[index] != None else "",
+            error))
+    if history != None:
+      for job_args, (status, duration, _) in zip(jobs, results):
+        if status == "ok":
+          history.record(BuildUtilities.job_key(job_args), duration)
+      history.close()
+      if any(prediction != None for prediction in predictions):
+        log("Makespan: predicted {:.2f}s, actual {:.2f}s".format(predicted_makespan,
+                                                                 actual_makespan))
+    failures = [result for result in results if result[0] != "ok"]
+    if len(failures) != 0:
+      raise Exception("{} of {} jobs failed".format(len(failures), len(jobs)))
+
+  @staticmethod
+  def resolve_paths(args, cwd):
+    """
+    Make the paths of a command line issued from cwd absolute.
+    """
+    for name in ("outputdir", "outputpath", "manifest", "mirrorcache", "artifactcache",
+                 "gocache", "wheelhouse", "workspaceroot", "checksumindex", "history",
+                 "timings_out", "trace"):
+      if getattr(args, name, None) != None:
+        setattr(args, name, os.path.join(cwd, getattr(args, name)))
+    # Package paths are written to descriptors as given, they are looked
+    # up from cwd instead.
+    args.cwd = cwd
+
+  @staticmethod
+  def run(args):
+    if args.function == "build" :
+      BuildUtilities.build(args)
+    elif args.function == "deploydesc" :
+      BuildUtilities.generate_bintray_descriptor(args.outputpath,args.project,
+                                args.repository,
+                                args.binname,
+                                args.user,
+                                args.description,
+                                args.branch_or_revision,
+                                args.package,
+                                args.licenses,
+                                args.labels,
+                                args.compact,
+                                args.packages,
+                                args.packagepattern,
+                                args.distribution,
+                                args.checksums,
+                                args.checksumindex,
+                                args.rehash,
+                                args.update,
+                                args.removepackage,
+                                getattr(args, "cwd", None))
+    elif args.function == "batch" :
+      BuildUtilities.batch(args)
+    elif args.function == "serve" :
+      BuildUtilities.serve(args)
+
+  @staticmethod
+  def run_request(raw_args, cwd):
+    args = BuildUtilities.parse_arguments(raw_args)
+    if args.function == "serve":
+      raise Exception("The build server can not start another server")
+    BuildUtilities.resolve_paths(args, cwd)
+    # Each request only reports its own phases and processes.
+    token = current_timings.set(Timings())
+    try:
+      BuildUtilities.run(args)
+      if args.timings_out != None:
+        timings.write(args.timings_out)
+      if args.trace != None:
+        timings.write_trace(args.trace)
+    finally:
+      current_timings.reset(token)
+
+  @staticmethod
+  def serve(args):
+    import signal
+    import threading
+    from .daemon import BuildServer
+    # GitPython is loaded once for all the requests.
+    import git
+    BuildUtilities.configure_resources(history_path=DEFAULT_HISTORY_PATH)
+    server = BuildServer(args.socket, args.workers, BuildUtilities.run_request)
+    # shutdown waits for serve_forever to return, it can not be called from
+    # the thread running it.
+    signal.signal(signal.SIGTERM,
+                  lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    log("Build server listening on {}".format(args.socket))
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+      os.remove(args.socket)
 
   @staticmethod
   def main():
     try:
       args = BuildUtilities.parse_arguments(sys.argv[1:])
-      if args.function == "build" :
-        if not os.path.exists(args.outputdir):
-          os.makedirs(args.outputdir, exist_ok=True)
-        if args.language == "python":
-          BuildUtilities.build_python(args.outputdir,
-            args.project, args.branch_or_revision,
-            args.arch, args.binname)
-        elif args.language == "go":
-          BuildUtilities.build_go(args.outputdir,
-            args.project, args.branch_or_revision,
-            args.arch, args.binname)
-        else:
-          raise Exception("Invalid language {}".format(args.language))
-      elif args.function == "deploydesc" :
-        BuildUtilities.generate_bintray_descriptor(args.outputpath,args.project,
-                                  args.repository,
-                                  args.binname,
-                                  args.user,
-                                  args.description,
-                                  args.branch_or_revision,
-                                  args.package,
-                                  args.licenses,
-                                  args.labels)
+      if args.daemon != None and args.function != "serve":
+        from .daemon import submit
+        status, error = submit(args.daemon, sys.argv[1:], os.getcwd(), print)
+        sys.exit(error if error != None else status)
+      if args.function == "build":
+        BuildUtilities.configure_resources(args.cpus, args.memory, args.history)
+      elif args.function == "batch":
+        BuildUtilities.configure_resources(history_path=args.history)
+      try:
+        BuildUtilities.run(args)
+      finally:
+        print(timings.summary())
+        if args.timings_out != None:
+          timings.write(args.timings_out)
+        if args.trace != None:
+          timings.write_trace(args.trace)
+        close_workspace_managers()
       sys.exit(0)
     except Exception as e:
       sys.exit(str(e))
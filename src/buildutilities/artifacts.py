@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import contextlib
+
+def tree_size(dir_path):
+  size = 0
+  for dir_name, _, file_list in os.walk(dir_path):
+    for fname in file_list:
+      size += os.lstat(os.path.join(dir_name, fname)).st_size
+  return size
+
+class ArtifactCache:
+  """
+  Content-addressed cache of build outputs. Entries are keyed on the
+  resolved commit and the build parameters, and the least recently used
+  ones are evicted when the cache grows over its maximum size.
+  """
+
+  def __init__(self, root_dir_path, max_size=None):
+    self.root_dir_path = os.path.abspath(root_dir_path)
+    self.objects_dir_path = os.path.join(self.root_dir_path, "objects")
+    self.index_path = os.path.join(self.root_dir_path, "index.json")
+    self.max_size = max_size
+    os.makedirs(self.objects_dir_path, exist_ok=True)
+
+  @staticmethod
+  def key(commit, arch, language, toolchain_version, bin_name, targets=None, builder=None):
+    import hashlib
+    fields = [commit, arch, language, toolchain_version, bin_name]
+    if targets != None:
+      fields.append(sorted(targets))
+    if builder != None:
+      # setup.py install and wheel installs lay out install/ differently.
+      fields.append(builder)
+    return hashlib.sha256(json.dumps(fields).encode("utf-8")).hexdigest()
+
+  @contextlib.contextmanager
+  def index(self):
+    """
+    Lock the cache and yield its index, which is saved back on exit.
+    """
+    with open(os.path.join(self.root_dir_path, ".lock"), "a") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        index = {"entries": {}, "hits": 0, "misses": 0}
+        if os.path.exists(self.index_path):
+          with open(self.index_path) as index_file:
+            index = json.load(index_file)
+        yield index
+        tmp_index_path = "{}.tmp".format(self.index_path)
+        with open(tmp_index_path, "w") as index_file:
+          json.dump(index, index_file, indent=2)
+        os.replace(tmp_index_path, self.index_path)
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  def restore(self, key, dest_dir_path):
+    """
+    Copy the tree cached under key to dest_dir_path. Return False on a miss.
+    """
+    with self.index() as index:
+      entry = index["entries"].get(key)
+      entry_dir_path = os.path.join(self.objects_dir_path, key)
+      if entry == None or not os.path.isdir(entry_dir_path):
+        index["entries"].pop(key, None)
+        index["misses"] += 1
+        return False
+      shutil.copytree(entry_dir_path, dest_dir_path, symlinks=True,
+                      dirs_exist_ok=True)
+      entry["last_access"] = time.time()
+      index["hits"] += 1
+      return True
+
+  def store(self, key, src_dir_path):
+    # The copy is done outside of the lock, only publishing it is serialized.
+    tmp_dir_path = os.path.join(self.objects_dir_path,
+                                "{}.{}.tmp".format(key, uuid.uuid4()))
+    shutil.copytree(src_dir_path, tmp_dir_path, symlinks=True)
+    with self.index() as index:
+      entry_dir_path = os.path.join(self.objects_dir_path, key)
+      if os.path.exists(entry_dir_path):
+        shutil.rmtree(entry_dir_path)
+      os.rename(tmp_dir_path, entry_dir_path)
+      index["entries"][key] = {"size": tree_size(entry_dir_path),
+                               "last_access": time.time()}
+      self.evict(index)
+
+  def evict(self, index):
+    if self.max_size == None:
+      return
+    entries = index["entries"]
+    total_size = sum(entry["size"] for entry in entries.values())
+    for key in sorted(entries, key=lambda k: entries[k]["last_access"]):
+      if total_size <= self.max_size:
+        break
+      shutil.rmtree(os.path.join(self.objects_dir_path, key), ignore_errors=True)
+      total_size -= entries.pop(key)["size"]
+
+  def statistics(self):
+    with self.index() as index:
+      return {"hits": index["hits"],
+              "misses": index["misses"],
+              "entries": len(index["entries"]),
+              "size": sum(entry["size"] for entry in index["entries"].values())}
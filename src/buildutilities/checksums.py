@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import collections
+
+ALGORITHMS = ["md5", "sha1", "sha256"]
+
+# Large reads let hashlib release the GIL for most of the hashing time.
+READ_SIZE = 1024 * 1024
+
+def file_digests(path):
+  """
+  Return the size and the digests of the file at path, read once.
+  """
+  import hashlib
+  hashes = [hashlib.new(algorithm) for algorithm in ALGORITHMS]
+  buffer = bytearray(READ_SIZE)
+  view = memoryview(buffer)
+  size = 0
+  with open(path, "rb", buffering=0) as infile:
+    while True:
+      count = infile.readinto(buffer)
+      if count == 0:
+        break
+      for digest in hashes:
+        digest.update(view[:count])
+      size += count
+  return {"size": size,
+          "checksums": {algorithm: digest.hexdigest()
+                        for algorithm, digest in zip(ALGORITHMS, hashes)}}
+
+class ChecksumIndex:
+  """
+  SQLite index of the digests of files, keyed by their path, device, inode,
+  size and modification time. An entry is only used when the stat of its
+  file still matches, otherwise the file is hashed again and the entry
+  replaced.
+  """
+
+  # Files modified this recently may still change within the same mtime,
+  # their digests are not recorded.
+  RACY_DELAY = 2.0
+
+  def __init__(self, index_path):
+    import sqlite3
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+    self.connection = sqlite3.connect(index_path, timeout=60, check_same_thread=False)
+    self.connection.execute("PRAGMA journal_mode=WAL")
+    # Entries are committed one by one, syncing each of them would dominate
+    # cold runs. With WAL a crash may only lose the last entries, which are
+    # hashed again.
+    self.connection.execute("PRAGMA synchronous=NORMAL")
+    self.connection.execute("CREATE TABLE IF NOT EXISTS digests ("
+                            "path TEXT PRIMARY KEY, device INTEGER, inode INTEGER, "
+                            "size INTEGER, mtime_ns INTEGER, md5 TEXT, sha1 TEXT, sha256 TEXT)")
+    self.hits = 0
+    self.misses = 0
+
+  def lookup(self, path, stat):
+    row = self.connection.execute("SELECT device, inode, size, mtime_ns, md5, sha1, sha256 "
+                                  "FROM digests WHERE path = ?", (path,)).fetchone()
+    if row == None or tuple(row[:4]) != (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns):
+      self.misses += 1
+      return None
+    self.hits += 1
+    return {"size": row[2], "checksums": dict(zip(ALGORITHMS, row[4:]))}
+
+  def store(self, path, stat, digest):
+    if stat.st_mtime_ns >= (time.time() - ChecksumIndex.RACY_DELAY) * 1e9:
+      return
+    # Committed right away, the index is shared with concurrent deploydesc
+    # runs which must not wait for the whole descriptor to be written.
+    with self.connection:
+      self.connection.execute("INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+                              + tuple(digest["checksums"][algorithm] for algorithm in ALGORITHMS))
+
+  def close(self):
+    self.connection.close()
+
+def digest_files(files, workers=None, index=None, rehash=False):
+  """
+  Yield the digests of files, a list of (path, stat) pairs, in order.
+  Files are looked up in index unless rehash is set, the others being
+  hashed several at the same time from a thread pool. Only a few files per
+  worker are hashed ahead of the consumer.
+  """
+  import concurrent.futures
+  workers = workers if workers != None else os.cpu_count() or 1
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    pending = collections.deque()
+
+    def next_digest():
+      path, stat, future = pending.popleft()
+      digest = future.result()
+      # Digests coming from the index have no stat, they are already stored.
+      if index != None and stat != None and digest["size"] == stat.st_size:
+        index.store(path, stat, digest)
+      return digest
+
+    for path, stat in files:
+      digest = None
+      if index != None and stat != None and not rehash:
+        digest = index.lookup(path, stat)
+      if digest != None:
+        future = concurrent.futures.Future()
+        future.set_result(digest)
+        pending.append((path, None, future))
+      else:
+        pending.append((path, stat, executor.submit(file_digests, path)))
+      if len(pending) >= workers * 4:
+        yield next_digest()
+    while len(pending) != 0:
+      yield next_digest()
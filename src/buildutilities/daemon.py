@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Resident build server listening on a unix domain socket.
+
+A client sends one JSON line {"argv": [...], "cwd": "..."} holding the
+command line of a job and the directory it was issued from. The server
+answers with {"type": "log", "line": "..."} lines while the job runs,
+followed by a single {"type": "result", "status": 0, "error": null} line.
+"""
+
+import os
+import json
+import socket
+import threading
+import socketserver
+from .runner import output
+
+class BuildRequestHandler(socketserver.StreamRequestHandler):
+
+  def handle(self):
+    request = json.loads(self.rfile.readline().decode())
+    lock = threading.Lock()
+
+    def send(message):
+      with lock:
+        self.wfile.write("{}\n".format(json.dumps(message)).encode())
+        self.wfile.flush()
+
+    status, error = 0, None
+    with self.server.workers:
+      token = output.set(lambda line: send({"type": "log", "line": line}))
+      try:
+        self.server.run_request(request["argv"], request["cwd"])
+      except SystemExit as e:
+        # Raised by argparse on invalid command lines.
+        status = e.code if isinstance(e.code, int) else 1
+        error = None if isinstance(e.code, int) else str(e.code)
+      except Exception as e:
+        status, error = 1, str(e)
+      finally:
+        output.reset(token)
+    send({"type": "result", "status": status, "error": error})
+
+class BuildServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  """
+  Serves build requests, running at most workers of them at the same time.
+  run_request is called with the command line and working directory of
+  each request from the thread handling it.
+  """
+  daemon_threads = True
+
+  def __init__(self, socket_path, workers, run_request):
+    if os.path.exists(socket_path):
+      os.remove(socket_path)
+    self.workers = threading.BoundedSemaphore(workers)
+    self.run_request = run_request
+    super().__init__(socket_path, BuildRequestHandler)
+
+def submit(socket_path, argv, cwd, on_log):
+  """
+  Send a job to the server at socket_path, calling on_log for each output
+  line, and return its exit status and error message.
+  """
+  with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+    client.connect(socket_path)
+    client.sendall("{}\n".format(json.dumps({"argv": argv, "cwd": cwd})).encode())
+    with client.makefile("rb") as responses:
+      for response in responses:
+        message = json.loads(response.decode())
+        if message["type"] == "log":
+          on_log(message["line"])
+        elif message["type"] == "result":
+          return message["status"], message["error"]
+  raise Exception("Connection to the build server lost")
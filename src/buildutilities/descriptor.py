@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import uuid
+import fcntl
+import fnmatch
+import functools
+import itertools
+import contextlib
+from .packages import stat_paths, resolve_path
+
+# Number of array items encoded at once when streaming an iterator.
+CHUNK_SIZE = 256
+
+@functools.lru_cache(maxsize=None)
+def encoder(indent):
+  if indent == None:
+    return json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+  return json.JSONEncoder(ensure_ascii=False, indent=indent)
+
+def dumps(value, indent, level):
+  text = encoder(indent).encode(value)
+  if indent == None or level == 0:
+    return text
+  return text.replace("\n", "\n" + " " * (indent * level))
+
+def encode(value, outfile, indent, level):
+  """
+  Write value as json.dump would. Iterators held by the dicts of value are
+  written as arrays, item by item.
+  """
+  if indent != None:
+    separators = (",", ": ")
+    newline = "\n" + " " * (indent * (level + 1))
+    end = "\n" + " " * (indent * level)
+  else:
+    separators = (",", ":")
+    newline = end = ""
+  if isinstance(value, dict) and len(value) != 0:
+    outfile.write("{")
+    for index, (key, item) in enumerate(value.items()):
+      outfile.write("{}{}{}{}".format(separators[0] if index != 0 else "", newline,
+                                      json.dumps(str(key), ensure_ascii=False),
+                                      separators[1]))
+      encode(item, outfile, indent, level + 1)
+    outfile.write("{}}}".format(end))
+  elif hasattr(value, "__next__"):
+    # Items are encoded by chunks, the brackets of each chunk being dropped.
+    empty = True
+    while True:
+      chunk = list(itertools.islice(value, CHUNK_SIZE))
+      if len(chunk) == 0:
+        break
+      text = dumps(chunk, indent, level)
+      outfile.write("{}{}".format("[" if empty else separators[0],
+                                  text[1:len(text) - len(end) - 1]))
+      empty = False
+    outfile.write("[]" if empty else "{}]".format(end))
+  else:
+    outfile.write(dumps(value, indent, level))
+
+def write_json(output_path, document, indent=2):
+  """
+  Atomically write document to output_path. The iterators held by its
+  dicts are consumed while writing, so large arrays never live in memory.
+  The output is compact when indent is None.
+  """
+  tmp_path = os.path.join(os.path.dirname(os.path.abspath(output_path)),
+                          ".{}.{}.tmp".format(os.path.basename(output_path), uuid.uuid4()))
+  try:
+    with open(tmp_path, "w", buffering=1024 * 1024) as outfile:
+      encode(document, outfile, indent, 0)
+    os.replace(tmp_path, output_path)
+  except BaseException:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+
+def canonical_hash(document):
+  import hashlib
+  text = json.dumps(document, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+@contextlib.contextmanager
+def lock(output_path):
+  """
+  Serialize the updates of the descriptor at output_path.
+  """
+  lock_path = os.path.join(os.path.dirname(os.path.abspath(output_path)),
+                           ".{}.lock".format(os.path.basename(output_path)))
+  with open(lock_path, "a") as lock_file:
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def entry_path(entry):
+  dir_path, name = os.path.split(entry["includePattern"])
+  if name.startswith("(") and name.endswith(")"):
+    name = name[1:-1]
+  return os.path.join(dir_path, name)
+
+def merge(previous, descriptor, removed=[], base_dir_path=None):
+  """
+  Merge the files of the previous descriptor into descriptor, whose files
+  must be a list. Previous files are replaced in place by the entries of
+  descriptor with the same include pattern, and dropped when they match
+  one of the removed globs or no longer exist. The release date is kept
+  for the same version. Relative files are looked up from base_dir_path.
+  Return the merged descriptor and the number of previous files dropped.
+  """
+  added = {entry["includePattern"]: entry for entry in descriptor["files"]}
+  candidates = [entry for entry in previous.get("files", [])
+                if entry["includePattern"] in added
+                or not any(fnmatch.fnmatch(entry_path(entry), pattern) for pattern in removed)]
+  results = stat_paths([resolve_path(entry_path(entry), base_dir_path) for entry in candidates])
+  files = []
+  for entry, result in zip(candidates, results):
+    if entry["includePattern"] in added:
+      files.append(added.pop(entry["includePattern"]))
+    elif not isinstance(result, OSError):
+      files.append(entry)
+  dropped = len(previous.get("files", [])) - len(files)
+  merged = dict(descriptor, files=files + list(added.values()))
+  version = previous.get("version", {})
+  if version.get("name") == descriptor["version"]["name"] and "released" in version:
+    merged["version"] = dict(descriptor["version"], released=version["released"])
+  return merged, dropped
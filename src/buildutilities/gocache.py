@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import stat
+import fcntl
+import shutil
+import contextlib
+from .artifacts import tree_size
+from .runner import log
+
+def remove_tree(dir_path):
+  # The go module cache is read-only, make directories writable on the way.
+  def make_writable(function, path, _):
+    os.chmod(os.path.dirname(path), stat.S_IRWXU)
+    if os.path.isdir(path):
+      os.chmod(path, stat.S_IRWXU)
+    function(path)
+  shutil.rmtree(dir_path, onerror=make_writable)
+
+class GoCache:
+  """
+  Persistent GOCACHE and GOMODCACHE shared by the go builds. The build cache
+  is separated per architecture while downloaded modules are shared. Builds
+  hold a shared lock on the cache, pruning only happens when none is running.
+  """
+
+  def __init__(self, root_dir_path, max_size=None):
+    self.root_dir_path = os.path.abspath(root_dir_path)
+    self.mod_cache_dir_path = os.path.join(self.root_dir_path, "mod")
+    self.max_size = max_size
+    os.makedirs(self.mod_cache_dir_path, exist_ok=True)
+
+  def build_cache_dir_path(self, arch):
+    return os.path.join(self.root_dir_path, "build", arch)
+
+  @contextlib.contextmanager
+  def lock(self, operation):
+    with open(os.path.join(self.root_dir_path, ".lock"), "a") as lock_file:
+      fcntl.flock(lock_file, operation)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  @contextlib.contextmanager
+  def environment(self, arch):
+    """
+    Yield the go environment variables pointing to the cache of arch.
+    """
+    build_cache_dir_path = self.build_cache_dir_path(arch)
+    os.makedirs(build_cache_dir_path, exist_ok=True)
+    with self.lock(fcntl.LOCK_SH):
+      yield {"GOCACHE": build_cache_dir_path,
+             "GOMODCACHE": self.mod_cache_dir_path}
+
+  def prune(self):
+    """
+    Shrink the cache under its maximum size, removing the least recently
+    used build cache entries first and the module cache last.
+    """
+    if self.max_size == None:
+      return
+    with open(os.path.join(self.root_dir_path, ".lock"), "a") as lock_file:
+      try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except BlockingIOError:
+        log("Go cache is in use, skipping pruning")
+        return
+      total_size = tree_size(self.root_dir_path)
+      if total_size <= self.max_size:
+        return
+      # Go refreshes the mtime of the build cache entries it uses.
+      entries = []
+      for dir_name, _, file_list in os.walk(os.path.join(self.root_dir_path, "build")):
+        for fname in file_list:
+          entry_path = os.path.join(dir_name, fname)
+          entry_stat = os.lstat(entry_path)
+          entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_path))
+      for _, size, entry_path in sorted(entries):
+        if total_size <= self.max_size:
+          return
+        os.remove(entry_path)
+        total_size -= size
+      remove_tree(self.mod_cache_dir_path)
+      os.makedirs(self.mod_cache_dir_path, exist_ok=True)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import fcntl
+import shutil
+import contextlib
+
+def project_url(project):
+  return "https://github.com/{}".format(project)
+
+def resolve_revision(repo, branch_or_revision):
+  """
+  Return the remote ref matching a branch or tag name, or the revision
+  itself when it does not name a ref (i.e. it is a commit SHA).
+  """
+  refs = [line.split("\t")[1] for line in
+          repo.git.ls_remote("origin", branch_or_revision).splitlines()]
+  for prefix in ("refs/heads/", "refs/tags/"):
+    if prefix + branch_or_revision in refs:
+      return prefix + branch_or_revision
+  return branch_or_revision
+
+def resolve_commit(project, branch_or_revision, mirror_cache=None):
+  """
+  Return the commit SHA designated by branch_or_revision without cloning the
+  project, or None if it cannot be determined from the remote refs.
+  """
+  # GitPython is slow to import, it is only loaded once git is needed.
+  from git import Repo, Git, GitCommandError
+  if mirror_cache != None:
+    with mirror_cache.source(project) as mirror_path:
+      try:
+        return Repo(mirror_path).git.rev_parse("--verify",
+                                               "{}^{{commit}}".format(branch_or_revision))
+      except GitCommandError:
+        return None
+  if re.match("^[0-9a-f]{40}$", branch_or_revision):
+    return branch_or_revision
+  commits = {}
+  for line in Git().ls_remote(project_url(project), branch_or_revision).splitlines():
+    sha, ref = line.split("\t")
+    commits[ref] = sha
+  for ref in ("refs/heads/{}", "refs/tags/{}^{{}}", "refs/tags/{}"):
+    ref = ref.format(branch_or_revision)
+    if ref in commits:
+      return commits[ref]
+  return None
+
+def fetch_revision(url, branch_or_revision, dest_dir_path):
+  """
+  Fetch the single commit designated by branch_or_revision at depth 1 and
+  check it out. Falls back to a blob-less partial fetch of the history when
+  the server refuses to serve the commit directly (e.g. abbreviated SHAs).
+  """
+  from git import Repo, GitCommandError
+  repo = Repo.init(dest_dir_path)
+  repo.create_remote("origin", url)
+  ref = resolve_revision(repo, branch_or_revision)
+  try:
+    repo.git.fetch("--depth", "1", "origin", ref)
+  except GitCommandError:
+    repo.git.fetch("--filter=blob:none", "--tags", "origin")
+    repo.git.checkout("--detach", branch_or_revision)
+    return repo
+  if ref.startswith("refs/heads/"):
+    repo.git.checkout("-B", branch_or_revision, "FETCH_HEAD")
+  else:
+    repo.git.checkout("--detach", "FETCH_HEAD")
+  return repo
+
+class MirrorCache:
+  """
+  Local cache holding one bare mirror per github project. Mirrors are
+  updated with an incremental fetch and used as the source of local clones.
+  Access to a mirror is serialized between processes with a file lock.
+  """
+
+  def __init__(self, root_dir_path):
+    self.root_dir_path = os.path.abspath(root_dir_path)
+    os.makedirs(self.root_dir_path, exist_ok=True)
+
+  def mirror_path(self, project):
+    return os.path.join(self.root_dir_path, "{}.git".format(project))
+
+  @contextlib.contextmanager
+  def lock(self, project):
+    lock_path = "{}.lock".format(self.mirror_path(project))
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+    with open(lock_path, "a") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        yield lock_file
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  def update(self, project):
+    """
+    Create or refresh the mirror of a project. Must be called with the
+    project lock held.
+    """
+    from git import Repo
+    mirror_path = self.mirror_path(project)
+    if os.path.exists(os.path.join(mirror_path, "HEAD")):
+      repo = Repo(mirror_path)
+      repo.git.fetch("--prune", "origin")
+    else:
+      # Clone next to the final location and rename it so that an
+      # interrupted clone never leaves a broken mirror behind.
+      tmp_mirror_path = "{}.tmp".format(mirror_path)
+      for path in (mirror_path, tmp_mirror_path):
+        if os.path.exists(path):
+          shutil.rmtree(path)
+      Repo.clone_from(project_url(project), tmp_mirror_path, mirror=True)
+      os.rename(tmp_mirror_path, mirror_path)
+      repo = Repo(mirror_path)
+    return repo
+
+  @contextlib.contextmanager
+  def source(self, project):
+    """
+    Update the mirror of a project and yield its path, keeping it
+    readable for the duration of the block.
+    """
+    with self.lock(project) as lock_file:
+      self.update(project)
+      # Other invocations only need to read the mirror from now on.
+      fcntl.flock(lock_file, fcntl.LOCK_SH)
+      yield self.mirror_path(project)
+
+  def clone(self, project, dest_dir_path):
+    from git import Repo
+    with self.source(project) as mirror_path:
+      repo = Repo.clone_from(mirror_path, dest_dir_path)
+    repo.remotes.origin.set_url(project_url(project))
+    return repo
+
+  def fetch(self, project, branch_or_revision, dest_dir_path):
+    with self.source(project) as mirror_path:
+      # --depth is ignored by git for plain local paths.
+      repo = fetch_revision("file://{}".format(mirror_path),
+                            branch_or_revision, dest_dir_path)
+    repo.remotes.origin.set_url(project_url(project))
+    return repo
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import glob
+import stat
+import fnmatch
+
+# Debian package file names are name_version_architecture.deb.
+DEFAULT_PACKAGE_PATTERN = r"^(?P<name>[^_]+)_(?P<version>[^_]+)_(?P<architecture>[^_]+)\.deb$"
+
+# Number of files stat'ed by a single task.
+STAT_BATCH_SIZE = 256
+
+def has_magic(path):
+  return any(c in path for c in "*?[")
+
+def resolve_path(path, base_dir_path=None):
+  """
+  Return the path to access path, given relative to base_dir_path.
+  """
+  if base_dir_path == None:
+    return path
+  return os.path.join(base_dir_path, path)
+
+def list_paths(path, base_dir_path=None):
+  """
+  Expand path, which may be a file, a directory whose files are listed or
+  a glob pattern. Return the matching paths, relative to base_dir_path like
+  path, and whether path was expanded.
+  """
+  resolved_path = resolve_path(path, base_dir_path)
+  if resolved_path == path:
+    return expand_path(path)
+  # Only the base directory is stripped, the paths keep the form of path.
+  prefix_length = len(os.path.join(base_dir_path, ""))
+  paths, expanded = expand_path(resolved_path)
+  return [p[prefix_length:] for p in paths], expanded
+
+def expand_path(path):
+  if os.path.isdir(path):
+    with os.scandir(path) as entries:
+      return sorted(entry.path for entry in entries if not entry.is_dir()), True
+  if not has_magic(path):
+    return [path], False
+  dir_path, name_pattern = os.path.split(path)
+  if has_magic(dir_path):
+    return sorted(p for p in glob.glob(path, recursive=True) if not os.path.isdir(p)), True
+  try:
+    with os.scandir(dir_path or os.curdir) as entries:
+      return sorted(os.path.join(dir_path, entry.name) for entry in entries
+                    if fnmatch.fnmatch(entry.name, name_pattern) and not entry.is_dir()), True
+  except FileNotFoundError:
+    return [], True
+
+def stat_batch(paths):
+  results = []
+  for path in paths:
+    try:
+      results.append(os.stat(path))
+    except OSError as e:
+      results.append(e)
+  return results
+
+def stat_paths(paths, workers=None):
+  """
+  Stat paths from a thread pool, returning the stat result or the error
+  of each of them.
+  """
+  batches = [paths[i:i + STAT_BATCH_SIZE] for i in range(0, len(paths), STAT_BATCH_SIZE)]
+  if len(batches) <= 1:
+    return stat_batch(paths)
+  import concurrent.futures
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    return [result for results in executor.map(stat_batch, batches) for result in results]
+
+def expand_packages(packages, package_sources=[], pattern=DEFAULT_PACKAGE_PATTERN,
+                    distribution=None, workers=None, base_dir_path=None):
+  """
+  Expand the package arguments of deploydesc into a list of
+  (path, distribution, architecture, stat) tuples, one per regular file.
+
+  packages are (path, distribution, architecture) triples whose path may be
+  a directory or a glob. The distribution and architecture of the files of
+  package_sources are parsed from their names with pattern, distribution
+  being used when pattern has no distribution group. The paths skipped are
+  returned along with the reason why. Relative paths are looked up from
+  base_dir_path but returned as given.
+  """
+  candidates = []
+  skipped = []
+  for path, package_distribution, architecture in packages:
+    paths, expanded = list_paths(path, base_dir_path)
+    if expanded and len(paths) == 0:
+      skipped.append((path, "no file matches"))
+    candidates.extend((p, package_distribution, architecture) for p in paths)
+  regex = re.compile(pattern)
+  for source in package_sources:
+    paths, _ = list_paths(source, base_dir_path)
+    if len(paths) == 0:
+      skipped.append((source, "no file matches"))
+    for path in paths:
+      match = regex.match(os.path.basename(path))
+      if match == None:
+        skipped.append((path, "name does not match {}".format(pattern)))
+        continue
+      fields = match.groupdict()
+      package_distribution = fields.get("distribution") or distribution
+      if package_distribution == None or fields.get("architecture") == None:
+        skipped.append((path, "unknown distribution or architecture"))
+        continue
+      candidates.append((path, package_distribution, fields["architecture"]))
+
+  expanded = []
+  for candidate, result in zip(candidates, stat_paths([resolve_path(c[0], base_dir_path)
+                                                        for c in candidates], workers)):
+    if isinstance(result, OSError):
+      skipped.append((candidate[0], result.strerror))
+    elif not stat.S_ISREG(result.st_mode):
+      skipped.append((candidate[0], "not a regular file"))
+    else:
+      expanded.append(candidate + (result,))
+  return expanded, skipped
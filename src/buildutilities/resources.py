@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import threading
+import contextlib
+from .runner import runner, log
+from .timings import timings
+
+# Memory assumed to be used per CPU by the commands never run before.
+DEFAULT_MEMORY_PER_CPU = 512 * 1024 * 1024
+
+def physical_memory():
+  return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+class ResourcePool:
+  """
+  CPU slots and memory budget shared by the toolchain processes of the
+  process. A command asks for a number of CPUs and is granted as many as
+  are free and fit in the memory left, estimated from the peak RSS of its
+  previous runs times its CPUs, or waits until at least one does. The grant
+  is passed to the toolchains with GOMAXPROCS, GOFLAGS=-p and MAKEFLAGS.
+  """
+
+  def __init__(self):
+    self.condition = threading.Condition()
+    self.cpus = os.cpu_count() or 1
+    self.memory = int(physical_memory() * 0.8)
+    self.used_cpus = 0
+    self.used_memory = 0
+    self.history = None
+
+  def configure(self, cpus=None, memory=None, history=None):
+    with self.condition:
+      if cpus != None:
+        self.cpus = cpus
+      if memory != None:
+        self.memory = memory
+      if history != None:
+        self.history = history
+      self.condition.notify_all()
+
+  def memory_per_cpu(self, key):
+    peak = self.history.peak(key) if self.history != None else None
+    if peak == None:
+      return DEFAULT_MEMORY_PER_CPU
+    # Leave some room, peaks vary from a run to the other.
+    return int(peak * 1.25)
+
+  def available(self, memory_per_cpu):
+    """
+    Return the number of CPUs which can be granted, a command gets at
+    least one when nothing else runs so that it cannot wait forever.
+    """
+    if self.used_cpus == 0:
+      return max(1, min(self.cpus, self.memory // memory_per_cpu))
+    return min(self.cpus - self.used_cpus,
+               (self.memory - self.used_memory) // memory_per_cpu)
+
+  @contextlib.contextmanager
+  def reserve(self, cpus, memory_per_cpu, prefix=""):
+    with self.condition:
+      if self.available(memory_per_cpu) < 1:
+        log("{}Waiting for a CPU and {} MB of memory".format(prefix,
+                                                            memory_per_cpu // (1024 * 1024)))
+        self.condition.wait_for(lambda: self.available(memory_per_cpu) >= 1)
+      granted = min(cpus, self.available(memory_per_cpu))
+      self.used_cpus += granted
+      self.used_memory += granted * memory_per_cpu
+    try:
+      yield granted
+    finally:
+      with self.condition:
+        self.used_cpus -= granted
+        self.used_memory -= granted * memory_per_cpu
+        self.condition.notify_all()
+
+  def run(self, args, cwd=None, env=None, prefix="", timeout=None, project=None, cpus=1):
+    """
+    Run a toolchain command with run_command semantics once resources are
+    available for it, using at most cpus CPUs.
+    """
+    key = "{} {}".format(project, " ".join(args[:2]))
+    with self.reserve(cpus, self.memory_per_cpu(key), prefix) as granted:
+      env = dict(env if env != None else os.environ)
+      env["GOMAXPROCS"] = str(granted)
+      env["GOFLAGS"] = " ".join(flag for flag in [env.get("GOFLAGS"), "-p={}".format(granted)]
+                                if flag)
+      env["MAKEFLAGS"] = "-j{}".format(granted)
+      start, pid, status, rusage = runner.run(args, cwd, env, prefix, timeout)
+    timings.add_child(args, pid, start, rusage)
+    if self.history != None and status == 0:
+      # The peak of the largest process, which ran on one of the CPUs granted.
+      self.history.record_peak(key, rusage.ru_maxrss * 1024)
+    return os.waitstatus_to_exitcode(status)
+
+resources = ResourcePool()
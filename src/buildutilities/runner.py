@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+import time
+import signal
+import threading
+import subprocess
+import contextvars
+from .timings import timings
+
+# Callable receiving the output lines of the current job, the output goes
+# to the terminal when it is not set.
+output = contextvars.ContextVar("output", default=None)
+
+terminal_lock = threading.Lock()
+
+def write_terminal(line):
+  with terminal_lock:
+    sys.stdout.write("{}\n".format(line))
+    sys.stdout.flush()
+
+def log(message):
+  sink = output.get()
+  if sink == None:
+    sink = write_terminal
+  for line in str(message).splitlines():
+    sink(line)
+
+class Runner:
+  """
+  Runs the toolchain processes from a single event loop living in a
+  background thread. Their output is streamed line by line with a prefix
+  identifying the job, and they are killed when exceeding their timeout.
+  Processes are reaped with wait4 so that their own resource usage is known.
+  Each of them leads its own process group, killed as a whole.
+  """
+
+  # Seconds waited for the output pipes to close once a process exited,
+  # they stay open while processes it left in the background are alive.
+  DRAIN_TIMEOUT = 5
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.loop = None
+    self.reapers = None
+
+  def event_loop(self):
+    # asyncio is slow to import, the loop is only started once needed.
+    import asyncio
+    import concurrent.futures
+    with self.lock:
+      if self.loop == None:
+        # wait4 blocks, each running process needs its own reaper thread.
+        self.reapers = concurrent.futures.ThreadPoolExecutor(max_workers=256,
+                                                             thread_name_prefix="reaper")
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="runner",
+                         daemon=True).start()
+      return self.loop
+
+  async def stream(self, pipe, emit):
+    import asyncio
+    reader = asyncio.StreamReader(limit=16 * 1024 * 1024)
+    transport, _ = await asyncio.get_running_loop().connect_read_pipe(
+      lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    try:
+      while True:
+        line = await reader.readline()
+        if len(line) == 0:
+          break
+        emit(line.decode(errors="replace").rstrip("\n"))
+    finally:
+      transport.close()
+
+  @staticmethod
+  def kill(process):
+    try:
+      os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+      pass
+
+  async def drain(self, process, streams):
+    import asyncio
+    try:
+      await asyncio.wait_for(streams, Runner.DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+      Runner.kill(process)
+
+  async def execute(self, args, cwd, env, emit, timeout, stdout=None):
+    """
+    Run a command, returning its pid, wait status and resource usage. The
+    lines of its standard output are appended to stdout instead of being
+    emitted when it is a list.
+    """
+    import asyncio
+    process = subprocess.Popen(args, cwd=cwd, shell=False, env=env,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               start_new_session=True)
+
+    def reap():
+      pid, status, rusage = os.wait4(process.pid, 0)
+      # Popen must know the child is gone, or it would wait for its pid
+      # again, which may belong to another child by then.
+      process.returncode = os.waitstatus_to_exitcode(status)
+      return pid, status, rusage
+
+    reaper = asyncio.get_running_loop().run_in_executor(self.reapers, reap)
+    streams = asyncio.gather(self.stream(process.stdout,
+                                         emit if stdout == None else stdout.append),
+                             self.stream(process.stderr, emit))
+    try:
+      await asyncio.wait_for(asyncio.shield(reaper), timeout)
+    except asyncio.TimeoutError:
+      Runner.kill(process)
+      await reaper
+      await self.drain(process, streams)
+      raise Exception("{} timed out after {} seconds".format(" ".join(args), timeout))
+    except asyncio.CancelledError:
+      Runner.kill(process)
+      raise
+    await self.drain(process, streams)
+    _, status, rusage = reaper.result()
+    return process.pid, status, rusage
+
+  def run(self, args, cwd=None, env=None, prefix="", timeout=None, stdout=None):
+    import asyncio
+    sink = output.get()
+    if sink == None:
+      sink = write_terminal
+    emit = lambda line: sink("{}{}".format(prefix, line))
+    start = time.perf_counter()
+    future = asyncio.run_coroutine_threadsafe(self.execute(args, cwd, env, emit, timeout,
+                                                           stdout),
+                                              self.event_loop())
+    try:
+      return (start,) + future.result()
+    except BaseException:
+      future.cancel()
+      raise
+
+runner = Runner()
+
+def run_command(args, cwd=None, env=None, prefix="", timeout=None, stdout=None):
+  """
+  Run a command on the shared runner and return its exit code. Its output
+  lines are prefixed with prefix, or collected in the stdout list for its
+  standard output, and its resource usage is accounted to the current phase.
+  """
+  start, pid, status, rusage = runner.run(args, cwd, env, prefix, timeout, stdout)
+  timings.add_child(args, pid, start, rusage)
+  return os.waitstatus_to_exitcode(status)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import heapq
+import threading
+
+class History:
+  """
+  SQLite store of the durations of the successful batch jobs and of the
+  peak memory usage of the toolchain commands, predicting them from their
+  last runs.
+  """
+
+  # Number of recent runs averaged by the predictions.
+  WINDOW = 5
+
+  def __init__(self, history_path):
+    import sqlite3
+    os.makedirs(os.path.dirname(os.path.abspath(history_path)), exist_ok=True)
+    self.connection = sqlite3.connect(history_path, timeout=60, check_same_thread=False)
+    self.connection.execute("PRAGMA journal_mode=WAL")
+    self.connection.execute("CREATE TABLE IF NOT EXISTS durations ("
+                            "key TEXT, duration REAL, finished REAL)")
+    self.connection.execute("CREATE INDEX IF NOT EXISTS durations_key "
+                            "ON durations (key, finished)")
+    self.connection.execute("CREATE TABLE IF NOT EXISTS peaks ("
+                            "key TEXT, maxrss INTEGER, finished REAL)")
+    self.connection.execute("CREATE INDEX IF NOT EXISTS peaks_key "
+                            "ON peaks (key, finished)")
+    # The connection is shared by the build threads.
+    self.lock = threading.Lock()
+
+  def predict(self, key):
+    """
+    Return the average duration of the last runs of key, None if it never ran.
+    """
+    with self.lock:
+      row = self.connection.execute("SELECT AVG(duration), COUNT(*) FROM (SELECT duration "
+                                    "FROM durations WHERE key = ? ORDER BY finished DESC "
+                                    "LIMIT ?)", (key, History.WINDOW)).fetchone()
+    return row[0] if row[1] != 0 else None
+
+  def record(self, key, duration):
+    self.insert("durations", key, duration)
+
+  def peak(self, key):
+    """
+    Return the highest peak RSS in bytes of the last runs of key, None if
+    it never ran.
+    """
+    with self.lock:
+      row = self.connection.execute("SELECT MAX(maxrss) FROM (SELECT maxrss "
+                                    "FROM peaks WHERE key = ? ORDER BY finished DESC "
+                                    "LIMIT ?)", (key, History.WINDOW)).fetchone()
+    return row[0]
+
+  def record_peak(self, key, maxrss):
+    self.insert("peaks", key, maxrss)
+
+  def insert(self, table, key, value):
+    with self.lock, self.connection:
+      self.connection.execute("INSERT INTO {} VALUES (?, ?, ?)".format(table),
+                              (key, value, time.time()))
+      # Only the runs used by the predictions are kept.
+      self.connection.execute("DELETE FROM {0} WHERE key = ? AND finished NOT IN "
+                              "(SELECT finished FROM {0} WHERE key = ? "
+                              "ORDER BY finished DESC LIMIT ?)".format(table),
+                              (key, key, History.WINDOW))
+
+  def close(self):
+    self.connection.close()
+
+def longest_first(predictions):
+  """
+  Return the indexes of predictions from the longest to the shortest job.
+  Jobs without history are assumed to last as long as the average known job.
+  """
+  known = [prediction for prediction in predictions if prediction != None]
+  default = sum(known) / len(known) if len(known) != 0 else 0.0
+  durations = [prediction if prediction != None else default for prediction in predictions]
+  return sorted(range(len(durations)), key=lambda index: -durations[index]), durations
+
+def makespan(durations, workers):
+  """
+  Return the makespan of durations started in order on workers, each job
+  going to the first worker available.
+  """
+  ends = [0.0] * min(workers, max(len(durations), 1))
+  for duration in durations:
+    heapq.heappush(ends, heapq.heappop(ends) + duration)
+  return max(ends)
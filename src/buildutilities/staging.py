@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import uuid
+import errno
+import filecmp
+import fcntl
+import shutil
+import threading
+
+# Not exposed by the fcntl module before python 3.12.
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+# Errors meaning that a method is not supported between two files, the
+# next method is tried when they are raised.
+UNSUPPORTED_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP,
+                      errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EBADF)
+
+class Stager:
+  """
+  Stages files into the output directory avoiding to duplicate their data
+  when possible. In link mode files are hardlinked, in clone mode they are
+  reflinked or copied in kernel with copy_file_range, falling back to a
+  regular copy when the filesystem does not support it. The number of bytes
+  staged by each method is recorded.
+  """
+
+  MODES = ["copy", "clone", "link"]
+  # Number of files staged by a single task when copying trees.
+  BATCH_SIZE = 64
+
+  def __init__(self, mode="clone", workers=None):
+    if not mode in Stager.MODES:
+      raise Exception("Unknown staging mode {}".format(mode))
+    self.mode = mode
+    self.workers = workers if workers != None else os.cpu_count() or 1
+    self.lock = threading.Lock()
+    self.statistics = {"linked": 0, "cloned": 0, "copied": 0, "files": 0}
+
+  def account(self, method, size):
+    with self.lock:
+      self.statistics[method] += size
+      self.statistics["files"] += 1
+
+  @staticmethod
+  def clone(src_path, dest_path):
+    with open(src_path, "rb") as src_file, open(dest_path, "wb") as dest_file:
+      try:
+        fcntl.ioctl(dest_file.fileno(), FICLONE, src_file.fileno())
+        return
+      except OSError as e:
+        if not e.errno in UNSUPPORTED_ERRORS:
+          raise
+      # Only available on Linux, the file is copied in user space elsewhere.
+      if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+      size = os.fstat(src_file.fileno()).st_size
+      copied = 0
+      while copied < size:
+        count = os.copy_file_range(src_file.fileno(), dest_file.fileno(), size - copied)
+        if count == 0:
+          break
+        copied += count
+
+  def copy_file(self, src_path, dest_path):
+    """
+    Stage the regular file src_path at dest_path, with the signature of
+    shutil.copy2.
+    """
+    if os.path.isdir(dest_path):
+      dest_path = os.path.join(dest_path, os.path.basename(src_path))
+    return self.stage(src_path, dest_path, os.stat(src_path).st_size)
+
+  def stage(self, src_path, dest_path, size):
+    if self.mode == "link":
+      try:
+        os.link(src_path, dest_path)
+        self.account("linked", size)
+        return dest_path
+      except OSError as e:
+        if not e.errno in UNSUPPORTED_ERRORS:
+          raise
+    if self.mode in ["clone", "link"]:
+      try:
+        Stager.clone(src_path, dest_path)
+        shutil.copystat(src_path, dest_path)
+        self.account("cloned", size)
+        return dest_path
+      except OSError as e:
+        if not e.errno in UNSUPPORTED_ERRORS:
+          raise
+    shutil.copy2(src_path, dest_path)
+    self.account("copied", size)
+    return dest_path
+
+  def copy_batch(self, batch):
+    for src_path, dest_path, size in batch:
+      self.stage(src_path, dest_path, size)
+
+  def copy_tree(self, src_dir_path, dest_dir_path):
+    """
+    Stage the tree src_dir_path at dest_dir_path, which must not exist, like
+    shutil.copytree with symlinks=True. Directories are scanned from the
+    calling thread while batches of their files are staged by a thread pool.
+    """
+    import concurrent.futures
+    directories = []
+    # A single worker would only add thread switches, batches are then
+    # staged in place.
+    executor = None
+    if self.workers > 1:
+      executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+    futures = []
+
+    def submit(batch):
+      if executor == None:
+        self.copy_batch(batch)
+      else:
+        futures.append(executor.submit(self.copy_batch, batch))
+
+    try:
+      pending = [(src_dir_path, dest_dir_path)]
+      while len(pending) != 0:
+        src_path, dest_path = pending.pop()
+        os.makedirs(dest_path)
+        directories.append((src_path, dest_path))
+        batch = []
+        with os.scandir(src_path) as entries:
+          for entry in entries:
+            entry_dest_path = os.path.join(dest_path, entry.name)
+            if entry.is_symlink():
+              os.symlink(os.readlink(entry.path), entry_dest_path)
+              shutil.copystat(entry.path, entry_dest_path, follow_symlinks=False)
+            elif entry.is_dir():
+              pending.append((entry.path, entry_dest_path))
+            else:
+              batch.append((entry.path, entry_dest_path, entry.stat().st_size))
+              if len(batch) == Stager.BATCH_SIZE:
+                submit(batch)
+                batch = []
+        if len(batch) != 0:
+          submit(batch)
+      for future in futures:
+        future.result()
+    finally:
+      if executor != None:
+        executor.shutdown()
+    # Writing the content of a directory changes its mtime, it is restored last.
+    for src_path, dest_path in reversed(directories):
+      shutil.copystat(src_path, dest_path)
+
+  @staticmethod
+  def kind(entry):
+    if entry.is_symlink():
+      return "link"
+    if entry.is_dir(follow_symlinks=False):
+      return "dir"
+    return "file"
+
+  def sync_tree(self, src_dir_path, dest_dir_path, counts=None):
+    """
+    Make dest_dir_path a copy of src_dir_path, only rewriting the files
+    whose size, mtime and content differ and removing those which are no
+    longer staged. Return the number of files unchanged, updated and removed.
+    """
+    if counts == None:
+      counts = {"unchanged": 0, "updated": 0, "removed": 0}
+    if not os.path.isdir(dest_dir_path):
+      os.makedirs(dest_dir_path)
+      shutil.copymode(src_dir_path, dest_dir_path)
+    with os.scandir(src_dir_path) as entries:
+      src_entries = {entry.name: entry for entry in entries}
+    with os.scandir(dest_dir_path) as entries:
+      for entry in entries:
+        src_entry = src_entries.get(entry.name)
+        if src_entry != None and Stager.kind(src_entry) == Stager.kind(entry):
+          continue
+        if Stager.kind(entry) == "dir":
+          shutil.rmtree(entry.path)
+        else:
+          os.remove(entry.path)
+        counts["removed"] += 1
+    for name, entry in src_entries.items():
+      dest_path = os.path.join(dest_dir_path, name)
+      kind = Stager.kind(entry)
+      if kind == "dir":
+        self.sync_tree(entry.path, dest_path, counts)
+      elif kind == "link":
+        if os.path.islink(dest_path) and os.readlink(dest_path) == os.readlink(entry.path):
+          counts["unchanged"] += 1
+          continue
+        if os.path.lexists(dest_path):
+          os.remove(dest_path)
+        os.symlink(os.readlink(entry.path), dest_path)
+        counts["updated"] += 1
+      elif os.path.lexists(dest_path) and filecmp.cmp(entry.path, dest_path, shallow=True):
+        # Same size and mtime, or same content.
+        if os.stat(dest_path).st_mode != entry.stat().st_mode:
+          shutil.copymode(entry.path, dest_path)
+        counts["unchanged"] += 1
+      else:
+        # Stage next to the destination so that readers never see a partial file.
+        tmp_path = os.path.join(dest_dir_path, ".{}.{}.tmp".format(name, uuid.uuid4()))
+        self.stage(entry.path, tmp_path, entry.stat().st_size)
+        os.replace(tmp_path, dest_path)
+        counts["updated"] += 1
+    return counts
+
+  def report(self):
+    return "Staged {} files: {} bytes linked, {} bytes cloned, {} bytes copied".format(
+           self.statistics["files"], self.statistics["linked"],
+           self.statistics["cloned"], self.statistics["copied"])
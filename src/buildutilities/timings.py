@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import resource
+import threading
+import contextlib
+import contextvars
+
+class Timings:
+  """
+  Records the wall and CPU time of the build phases along with the resource
+  usage of the child processes they spawn. Phases are tracked per thread so
+  that concurrent builds are accounted separately.
+  """
+
+  def __init__(self):
+    self.origin = time.perf_counter()
+    self.lock = threading.Lock()
+    self.local = threading.local()
+    self.phases = []
+    self.processes = []
+
+  def active_phases(self):
+    if not hasattr(self.local, "phases"):
+      self.local.phases = []
+    return self.local.phases
+
+  @contextlib.contextmanager
+  def phase(self, name, **attributes):
+    record = {"name": name,
+              "attributes": attributes,
+              "thread": threading.get_native_id(),
+              "start": time.perf_counter() - self.origin,
+              "children": {"count": 0, "user": 0.0, "sys": 0.0, "maxrss": 0}}
+    cpu_start = time.thread_time()
+    self.active_phases().append(record)
+    try:
+      yield record
+    finally:
+      self.active_phases().pop()
+      record["wall"] = time.perf_counter() - self.origin - record["start"]
+      record["cpu"] = time.thread_time() - cpu_start
+      with self.lock:
+        self.phases.append(record)
+
+  def add_child(self, args, pid, start, rusage):
+    """
+    Record a terminated child process started at the perf_counter value
+    start, and account its resource usage to the innermost phase of the
+    calling thread.
+    """
+    attributes = {}
+    if len(self.active_phases()) != 0:
+      phase = self.active_phases()[-1]
+      attributes = phase["attributes"]
+      phase["children"]["count"] += 1
+      phase["children"]["user"] += rusage.ru_utime
+      phase["children"]["sys"] += rusage.ru_stime
+      phase["children"]["maxrss"] = max(phase["children"]["maxrss"], rusage.ru_maxrss)
+    with self.lock:
+      self.processes.append({"args": list(args),
+                             "pid": pid,
+                             "attributes": attributes,
+                             "thread": threading.get_native_id(),
+                             "start": start - self.origin,
+                             "wall": time.perf_counter() - start,
+                             "user": rusage.ru_utime,
+                             "sys": rusage.ru_stime,
+                             "maxrss": rusage.ru_maxrss})
+
+  def report(self):
+    # Also covers the processes spawned outside of run_command, e.g. by git.
+    rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    with self.lock:
+      phases = sorted(self.phases, key=lambda phase: phase["start"])
+      processes = sorted(self.processes, key=lambda process: process["start"])
+    return {"wall": time.perf_counter() - self.origin,
+            "cpu": time.process_time(),
+            "children": {"user": rusage.ru_utime,
+                         "sys": rusage.ru_stime,
+                         "maxrss": rusage.ru_maxrss},
+            "phases": phases,
+            "processes": processes}
+
+  def write(self, output_path):
+    with open(output_path, "w") as outfile:
+      json.dump(self.report(), outfile, indent=2)
+
+  def write_trace(self, output_path):
+    """
+    Write the phases and processes as Chrome trace events, which can be
+    loaded in chrome://tracing or Perfetto.
+    """
+    pid = os.getpid()
+    with self.lock:
+      phases = list(self.phases)
+      processes = list(self.processes)
+    events = [{"name": "process_name", "ph": "M", "pid": pid,
+               "args": {"name": "build-utilities"}}]
+    for thread in sorted(set(record["thread"] for record in phases + processes)):
+      events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread,
+                     "args": {"name": "thread {}".format(thread)}})
+    for phase in phases:
+      events.append({"name": phase["name"], "cat": "phase", "ph": "X",
+                     "ts": phase["start"] * 1e6, "dur": phase["wall"] * 1e6,
+                     "pid": pid, "tid": phase["thread"],
+                     "args": dict(phase["attributes"], cpu=phase["cpu"],
+                                  **phase["children"])})
+    for process in processes:
+      events.append({"name": " ".join(process["args"][:2]), "cat": "process", "ph": "X",
+                     "ts": process["start"] * 1e6, "dur": process["wall"] * 1e6,
+                     "pid": pid, "tid": process["thread"],
+                     "args": dict(process["attributes"], pid=process["pid"],
+                                  command=" ".join(process["args"]),
+                                  user=process["user"], sys=process["sys"],
+                                  maxrss=process["maxrss"])})
+    with open(output_path, "w") as outfile:
+      json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, outfile)
+
+  def summary(self):
+    report = self.report()
+    totals = {}
+    for phase in report["phases"]:
+      total = totals.setdefault(phase["name"], {"count": 0, "wall": 0.0, "cpu": 0.0,
+                                                "user": 0.0, "sys": 0.0, "maxrss": 0})
+      total["count"] += 1
+      total["wall"] += phase["wall"]
+      total["cpu"] += phase["cpu"]
+      total["user"] += phase["children"]["user"]
+      total["sys"] += phase["children"]["sys"]
+      total["maxrss"] = max(total["maxrss"], phase["children"]["maxrss"])
+    lines = ["{:<20} {:>5} {:>9} {:>9} {:>9} {:>9} {:>11}".format(
+             "phase", "count", "wall(s)", "cpu(s)", "user(s)", "sys(s)", "maxrss(KB)")]
+    for name, total in totals.items():
+      lines.append("{:<20} {:>5} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>11}".format(
+                   name, total["count"], total["wall"], total["cpu"],
+                   total["user"], total["sys"], total["maxrss"]))
+    lines.append("{:<20} {:>5} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>11}".format(
+                 "total", "", report["wall"], report["cpu"],
+                 report["children"]["user"], report["children"]["sys"],
+                 report["children"]["maxrss"]))
+    return "\n".join(lines)
+
+# Timings of the current job, the build server gives each request its own.
+current = contextvars.ContextVar("timings", default=None)
+
+class CurrentTimings:
+  """
+  Forwards to the Timings of the current job, or to the process wide ones
+  when none is set.
+  """
+
+  def __init__(self, default):
+    self.default = default
+
+  def __getattr__(self, name):
+    job_timings = current.get()
+    return getattr(job_timings if job_timings != None else self.default, name)
+
+timings = CurrentTimings(Timings())
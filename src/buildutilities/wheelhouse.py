@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import glob
+import fcntl
+import subprocess
+import contextlib
+from .resources import resources
+
+ABI_TAG_SCRIPT = "import sys, sysconfig; print('{}-{}'.format(sys.implementation.cache_tag, sysconfig.get_platform()))"
+
+class Wheelhouse:
+  """
+  Local cache of the wheels of python dependencies. Wheels are stored per
+  interpreter ABI and platform, their file names carrying the project name
+  and version, so that repeated builds install them offline.
+  """
+
+  def __init__(self, root_dir_path, python="python3"):
+    self.root_dir_path = os.path.abspath(root_dir_path)
+    self.python = python
+    abi_tag = subprocess.check_output([self.python, "-c", ABI_TAG_SCRIPT]).decode().strip()
+    self.wheels_dir_path = os.path.join(self.root_dir_path, abi_tag)
+    os.makedirs(self.wheels_dir_path, exist_ok=True)
+
+  @contextlib.contextmanager
+  def lock(self):
+    with open(os.path.join(self.wheels_dir_path, ".lock"), "a") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  def pip(self, args, cwd, env, prefix="", timeout=None, project=None):
+    return resources.run([self.python, "-m", "pip"] + args, cwd, env, prefix, timeout,
+                         project, resources.cpus) == 0
+
+  def install(self, src_dir_path, install_dir_path, env, prefix="", timeout=None, project=None):
+    """
+    Build a wheel of the project in src_dir_path, add the wheels of its
+    missing dependencies to the wheelhouse and install everything offline
+    under the install_dir_path prefix.
+    """
+    import tempfile
+    with tempfile.TemporaryDirectory() as dist_dir_path:
+      if not self.pip(["wheel", "--no-deps", "--wheel-dir", dist_dir_path, "."],
+                      src_dir_path, env, prefix, timeout, project):
+        raise Exception("Error while building the project wheel")
+      wheel_path = glob.glob(os.path.join(dist_dir_path, "*.whl"))[0]
+      with self.lock():
+        # Only reach the package index when some dependency is missing.
+        wheel_args = ["--wheel-dir", self.wheels_dir_path,
+                      "--find-links", self.wheels_dir_path, wheel_path]
+        if not self.pip(["wheel", "--no-index", "--quiet"] + wheel_args,
+                        src_dir_path, env, prefix, timeout, project):
+          if not self.pip(["wheel"] + wheel_args, src_dir_path, env, prefix, timeout, project):
+            raise Exception("Error while building the dependencies wheels")
+        # The project wheel changes at every build, it is not worth caching.
+        cached_wheel_path = os.path.join(self.wheels_dir_path, os.path.basename(wheel_path))
+        if os.path.exists(cached_wheel_path):
+          os.remove(cached_wheel_path)
+        if not self.pip(["install", "--no-index", "--find-links", self.wheels_dir_path,
+                         "--ignore-installed", "--prefix", install_dir_path, wheel_path],
+                        src_dir_path, env, prefix, timeout, project):
+          raise Exception("Error while installing the project")
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Entry points of the processes of the batch pool. They live outside of
+__main__, which multiprocessing does not import in its workers.
+"""
+
+from .runner import output, write_terminal
+from .timings import Timings, current as current_timings
+
+def initialize(cpus, memory, history_path):
+  """
+  Set up a process of the pool, which gets its share of the CPUs and
+  memory, in MB, of the machine for all the jobs it runs.
+  """
+  from .__main__ import BuildUtilities
+  BuildUtilities.configure_resources(cpus, memory, history_path)
+
+def run_job(job_args, prefix):
+  """
+  Run a batch job, prefixing its output lines with prefix.
+  """
+  from .__main__ import BuildUtilities
+  output_token = output.set(lambda line: write_terminal("{}{}".format(prefix, line)))
+  # The worker outlives the job, only the job is reported.
+  timings_token = current_timings.set(Timings())
+  try:
+    BuildUtilities.run(job_args)
+  finally:
+    current_timings.reset(timings_token)
+    output.reset(output_token)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# This file is part of build-utilities.
+#
+#    build-utilities is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    build-utilities is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details
+#
+#    You should have received a copy of the GNU General Public License
+#    along with build-utilities.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import uuid
+import fcntl
+import queue
+import threading
+import contextlib
+from .gocache import remove_tree
+from .runner import log
+
+class WorkspaceManager:
+  """
+  Hands out empty scratch directories below root_dir_path. Released
+  workspaces are emptied by a background thread and kept ready for reuse,
+  up to pool_size of them.
+
+  Workspaces move between the ready and busy directories. A busy workspace
+  has a lock file held by the process using or cleaning it, so the busy
+  workspaces whose lock is free were left by a crashed run and are
+  collected. The lock files are only created and removed while holding the
+  manager lock.
+  """
+
+  def __init__(self, root_dir_path, pool_size=4):
+    self.root_dir_path = os.path.abspath(root_dir_path)
+    self.ready_dir_path = os.path.join(self.root_dir_path, "ready")
+    self.busy_dir_path = os.path.join(self.root_dir_path, "busy")
+    self.pool_size = pool_size
+    self.owned = {}
+    self.cleanups = queue.Queue()
+    self.cleaner = None
+    self.lock = threading.Lock()
+    os.makedirs(self.ready_dir_path, exist_ok=True)
+    os.makedirs(self.busy_dir_path, exist_ok=True)
+
+  @contextlib.contextmanager
+  def manager_lock(self):
+    with self.lock, open(os.path.join(self.root_dir_path, ".lock"), "a") as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+  def lock_workspace(self, name, blocking=True):
+    """
+    Open and lock the lock file of the workspace name. When not blocking,
+    return None if it is held by another process.
+    """
+    lock_file = open(os.path.join(self.busy_dir_path, "{}.lock".format(name)), "a")
+    try:
+      fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+      lock_file.close()
+      return None
+    return lock_file
+
+  def start_cleaner(self):
+    if self.cleaner == None:
+      self.cleaner = threading.Thread(target=self.clean, name="workspace-cleaner",
+                                      daemon=True)
+      self.cleaner.start()
+
+  def acquire(self):
+    """
+    Return the path of an empty workspace owned by the caller.
+    """
+    with self.manager_lock():
+      ready = os.listdir(self.ready_dir_path)
+      if len(ready) != 0:
+        name = ready[0]
+        lock_file = self.lock_workspace(name)
+        os.rename(os.path.join(self.ready_dir_path, name),
+                  os.path.join(self.busy_dir_path, name))
+      else:
+        name = str(uuid.uuid4())
+        lock_file = self.lock_workspace(name)
+        os.makedirs(os.path.join(self.busy_dir_path, name))
+      workspace_path = os.path.join(self.busy_dir_path, name)
+      self.owned[workspace_path] = lock_file
+    return workspace_path
+
+  def release(self, workspace_path):
+    """
+    Hand the workspace to the cleaner thread, it is emptied asynchronously.
+    """
+    with self.lock:
+      lock_file = self.owned.pop(workspace_path)
+    self.cleanups.put((workspace_path, lock_file))
+    self.start_cleaner()
+
+  @contextlib.contextmanager
+  def workspace(self):
+    workspace_path = self.acquire()
+    try:
+      yield workspace_path
+    finally:
+      self.release(workspace_path)
+
+  def fill(self):
+    """
+    Create empty workspaces until pool_size of them are ready.
+    """
+    with self.manager_lock():
+      for _ in range(len(os.listdir(self.ready_dir_path)), self.pool_size):
+        os.makedirs(os.path.join(self.ready_dir_path, str(uuid.uuid4())))
+
+  def collect(self):
+    """
+    Queue the cleanup of the workspaces left busy by crashed processes.
+    """
+    orphans = 0
+    with self.manager_lock():
+      for name in os.listdir(self.busy_dir_path):
+        workspace_path = os.path.join(self.busy_dir_path, name)
+        if name.endswith(".lock") or workspace_path in self.owned:
+          continue
+        lock_file = self.lock_workspace(name, blocking=False)
+        if lock_file == None:
+          continue
+        self.cleanups.put((workspace_path, lock_file))
+        orphans += 1
+    if orphans != 0:
+      log("Collecting {} orphaned workspaces".format(orphans))
+      self.start_cleaner()
+    return orphans
+
+  def clean(self):
+    while True:
+      workspace_path, lock_file = self.cleanups.get()
+      try:
+        name = os.path.basename(workspace_path)
+        with os.scandir(workspace_path) as entries:
+          for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+              remove_tree(entry.path)
+            else:
+              os.remove(entry.path)
+        with self.manager_lock():
+          if len(os.listdir(self.ready_dir_path)) < self.pool_size:
+            os.rename(workspace_path, os.path.join(self.ready_dir_path, name))
+          else:
+            os.rmdir(workspace_path)
+          os.remove(os.path.join(self.busy_dir_path, "{}.lock".format(name)))
+      except Exception as e:
+        log("Error while cleaning workspace {}: {}".format(workspace_path, e))
+      finally:
+        lock_file.close()
+        self.cleanups.task_done()
+
+  def close(self):
+    """
+    Wait for the pending cleanups.
+    """
+    self.cleanups.join()
+
+managers = {}
+managers_lock = threading.Lock()
+
+def workspace_manager(root_dir_path, pool_size=4):
+  """
+  Return the manager of root_dir_path shared by the builds of the process.
+  Orphaned workspaces are collected and the pool filled when it is created.
+  """
+  root_dir_path = os.path.abspath(root_dir_path)
+  with managers_lock:
+    manager = managers.get(root_dir_path)
+    if manager == None:
+      manager = WorkspaceManager(root_dir_path, pool_size)
+      manager.collect()
+      manager.fill()
+      managers[root_dir_path] = manager
+  return manager
+
+def close_workspace_managers():
+  with managers_lock:
+    for manager in managers.values():
+      manager.close()